@@ -0,0 +1,75 @@
+"""Benchmarks merging a generated package with an increasing number of parsing worker processes.
+
+Usage: python benchmarks/bench_parallel_parse.py [files_count] [max_jobs]
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from monoscript import PythonModuleMerger  # noqa: E402
+
+FILE_TEMPLATE = '''import os
+from collections import defaultdict
+from .module_{previous} import function_{previous}_0
+
+__all__ = [{names}]
+
+'''
+FUNCTION_TEMPLATE = '''
+
+def function_{file_ix}_{function_ix}(value, *args, **kwargs):
+    """Generated function {function_ix} of module {file_ix}."""
+    result = defaultdict(list)
+    for ix, item in enumerate(args):
+        if ix % 2 and item:
+            result[ix].append([x * value for x in range(ix) if x % 3])
+        else:
+            result[ix].append(os.path.join(str(item), str(kwargs.get('suffix', ''))))
+    return result
+'''
+
+
+def generate_package(path, files_count, functions_count=40):
+    package_path = join(path, 'bench_package')
+    os.makedirs(package_path)
+    with open(join(package_path, '__init__.py'), 'w') as fou:
+        fou.write('from .module_0 import function_0_0\n')
+    for file_ix in range(files_count):
+        names = ', '.join(f"'function_{file_ix}_{function_ix}'" for function_ix in range(functions_count))
+        with open(join(package_path, f'module_{file_ix}.py'), 'w') as fou:
+            fou.write(FILE_TEMPLATE.format(previous=max(file_ix - 1, 0), names=names))
+            for function_ix in range(functions_count):
+                fou.write(FUNCTION_TEMPLATE.format(file_ix=file_ix, function_ix=function_ix))
+    return package_path
+
+
+def main():
+    files_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    max_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        package_path = generate_package(tempdir, files_count)
+        jobs, module_code_hash, serial_time = 1, None, None
+        print(f"{'jobs':>6} {'seconds':>10} {'speedup':>8}")
+        while jobs <= max_jobs:
+            merger = PythonModuleMerger(package_path, output_dir=join(tempdir, 'dist'), jobs=jobs,
+                                        run_test_scripts=False)
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                merger.merge_files()
+            elapsed = time.perf_counter() - start_time
+
+            serial_time = serial_time or elapsed
+            module_code_hash = module_code_hash or merger.module_code_hash
+            assert module_code_hash == merger.module_code_hash, "parallel output differs from serial output"
+            print(f"{jobs:>6} {elapsed:>10.3f} {serial_time / elapsed:>7.2f}x")
+            jobs *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
 from .merger import PythonModuleMerger, ProcessAllStrategy, ImportConflictException
 from .parser import ScriptParser
+from .graph import ImportGraph
+from .discovery import FileDiscovery
+from .batch import BatchMerger
 from .__main__ import main
 VERSION = '1.0.3'
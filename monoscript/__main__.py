@@ -1,4 +1,6 @@
 import argparse
+import sys
+from .batch import BatchMerger
 from .merger import PythonModuleMerger, ProcessAllStrategy
 
 
@@ -6,7 +8,9 @@ def main(argv=None):
     parser = argparse.ArgumentParser(
         description="A Python tool that merges multi-file modules into a single, self-contained script.")
 
-    parser.add_argument("module_path", help="Path to the module directory.")
+    parser.add_argument("module_path", nargs="*",
+                        help="Path to the module directory (several modules are merged as a batch).")
+    parser.add_argument("--manifest", help="JSON manifest of the modules to merge as a batch.")
     parser.add_argument("-D", "--output_dir", default="dist", help="Output directory for the merged script.")
     parser.add_argument("--process-all", choices=["NONE", "AUTO", "INIT"], default="AUTO",
                         help="Strategy for processing __all__ variable.")
@@ -15,6 +19,27 @@ def main(argv=None):
     parser.add_argument("--no-organize-imports", action="store_false", dest="organize_imports",
                         help="Disable import organization.")
     parser.add_argument("--module-name", help="Name of the output module.")
+    parser.add_argument("--tree-shake", action="store_true",
+                        help="Drop the top-level functions and classes, and the organized imports, that neither "
+                             "__all__, __main__.py nor the module-level statements reach.")
+    parser.add_argument("--remove-unused-imports", action="store_true",
+                        help="Drop the organized imports binding names that no merged code uses "
+                             "(implied by --tree-shake).")
+    parser.add_argument("--keep-import", action="append", metavar="MODULE",
+                        help="Never remove the imports of MODULE, imported for its side effects. Can be repeated.")
+    parser.add_argument("--minify", type=int, nargs="?", const=1, default=0, choices=[0, 1, 2, 3], metavar="LEVEL",
+                        help="Minify the merged code: 1 strips docstrings, comments and blank lines, 2 annotations "
+                             "too (those of decorated functions excepted), 3 re-emits the code with ast.unparse "
+                             "(default level: 1).")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Bundle the marshalled code of each file, imported from memory with its own namespace, "
+                             "instead of merging the code.")
+    parser.add_argument("--lazy-segments", action="store_true",
+                        help="Run the code of each file on first access to one of its names (module __getattr__), "
+                             "__init__.py excepted. The files are precompiled for the running Python version, other "
+                             "versions compile them on first access.")
+    parser.add_argument("--lazy-imports", action="store_true",
+                        help="Load the third-party modules of organized 'import x' statements on first use.")
 
     # Metadata arguments
     parser.add_argument("--module-version", default="", help="Module version.")
@@ -31,8 +56,83 @@ def main(argv=None):
     parser.add_argument("--merge-test-scripts", action="store_true", help="Merge test scripts into the output.")
     parser.add_argument("--no-run-test-scripts", action="store_false", dest="run_test_scripts",
                         help="Disable running test scripts after merging.")
+    parser.add_argument("--test-jobs", type=int, default=1,
+                        help="Number of test scripts run concurrently, their output shown at the end (0: number of "
+                             "CPUs).")
+    parser.add_argument("--test-timeout", type=float, metavar="SECONDS",
+                        help="Kill, and fail, the test scripts running longer than SECONDS.")
+
+    # Parse cache arguments
+    parser.add_argument("--cache-dir", help="Directory of the parse cache (disabled if not set).")
+    parser.add_argument("--cache-max-size", type=int, default=256, help="Maximum parse cache size in MB.")
+
+    # Parallel parsing arguments
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes parsing files (0: number of CPUs).")
+
+    # File discovery arguments
+    parser.add_argument("--include", action="append", metavar="PATTERN",
+                        help="Include files matching PATTERN (.gitignore syntax, default: *.py). Can be repeated.")
+    parser.add_argument("--exclude", action="append", metavar="PATTERN",
+                        help="Exclude files and directories matching PATTERN (.gitignore syntax). Can be repeated.")
+    parser.add_argument("--use-gitignore", action="store_true",
+                        help="Exclude the files ignored by the .gitignore files of the module and its repository.")
+
+    # Reproducible output arguments
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Omit the generation time from the header, unless SOURCE_DATE_EPOCH is set.")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with code 1 if the output file is not up to date, without writing it "
+                             "(implies --reproducible).")
+
+    # Output target arguments
+    parser.add_argument("--pyc", action="store_true",
+                        help="Also write a hash-based .pyc of the merged module in the __pycache__ directory of "
+                             "the output.")
+    parser.add_argument("--zipapp", action="store_true",
+                        help="Also write an executable <module name>.pyz zipapp with the precompiled merged module.")
+    parser.add_argument("--zipapp-interpreter", default="/usr/bin/env python3",
+                        help="Shebang interpreter of the zipapp (empty: not executable).")
+
+    # Import profiling arguments
+    parser.add_argument("--profile-import", action="store_true",
+                        help="Profile the import time of the merged module (-X importtime) and print the top "
+                             "offenders. The time is attributed to the file segments by their markers, not with "
+                             "--minify, --lazy-segments and --bundle.")
+    parser.add_argument("--import-time-budget", type=float, metavar="MS",
+                        help="Fail if importing the merged module takes longer than MS milliseconds "
+                             "(implies --profile-import).")
+    parser.add_argument("--profile-top", type=int, default=10,
+                        help="Number of hoisted imports and file segments listed by --profile-import.")
+
+    # Import graph arguments
+    parser.add_argument("--emit-graph", metavar="GRAPH_FILE",
+                        help="Write the internal import graph to GRAPH_FILE "
+                             "(DOT if it ends with .dot or .gv, else JSON).")
+
+    # Watch mode arguments
+    parser.add_argument("--watch", action="store_true", help="Re-merge the module each time one of its files changes.")
+    parser.add_argument("--watch-interval", type=float, default=1.0, help="Watch mode polling interval in seconds.")
 
     args = parser.parse_args(args=argv)
+    batch = args.manifest or len(args.module_path) > 1
+    if not args.module_path and not args.manifest:
+        parser.error("a module_path or a --manifest is required")
+    if batch and (args.module_name or args.emit_graph or args.watch):
+        parser.error("--module-name, --emit-graph and --watch apply to a single module")
+
+    if args.bundle and (args.tree_shake or args.remove_unused_imports or args.minify or args.lazy_imports or
+                        args.lazy_segments):
+        parser.error("--bundle cannot be combined with --tree-shake, --remove-unused-imports, --minify, "
+                     "--lazy-imports and --lazy-segments")
+
+    if args.lazy_imports and sys.version_info < (3, 10):
+        parser.error("--lazy-imports requires Python 3.10 or later")
+
+    if (args.profile_import or args.import_time_budget is not None) and (args.minify or args.lazy_segments or
+                                                                         args.bundle):
+        parser.error("--profile-import and --import-time-budget cannot be combined with --minify, --lazy-segments "
+                     "and --bundle")
 
     process_all_strategy = ProcessAllStrategy[args.process_all]
 
@@ -42,14 +142,25 @@ def main(argv=None):
             key, value = item.split("=")
             additional_headers[key] = value
 
-    merger = PythonModuleMerger(
-        module_path=args.module_path,
+    kwargs = dict(
         output_dir=args.output_dir,
         process_all_strategy=process_all_strategy,
         custom_all=args.custom_all.split(',') if args.custom_all else None,  # Split comma-separated values
         additional_all=args.additional_all.split(',') if args.additional_all else None,
         organize_imports=args.organize_imports,
-        module_name=args.module_name,
+        lazy_imports=args.lazy_imports,
+        tree_shake=args.tree_shake,
+        remove_unused_imports=args.remove_unused_imports,
+        keep_imports=args.keep_import,
+        minify=args.minify,
+        pyc=args.pyc,
+        zipapp=args.zipapp,
+        zipapp_interpreter=args.zipapp_interpreter or None,
+        bundle=args.bundle,
+        lazy_segments=args.lazy_segments,
+        profile_import=args.profile_import,
+        import_time_budget=args.import_time_budget,
+        profile_top=args.profile_top,
         module_version=args.module_version,
         module_description=args.module_description,
         author=args.author,
@@ -61,9 +172,37 @@ def main(argv=None):
         test_scripts_dirname=args.test_scripts_dirname,
         merge_test_scripts=args.merge_test_scripts,
         run_test_scripts=None if args.run_test_scripts else False,
+        test_jobs=args.test_jobs,
+        test_timeout=args.test_timeout,
+        cache_dir=args.cache_dir,
+        cache_max_size=args.cache_max_size * 1024 * 1024,
+        jobs=args.jobs,
+        include=args.include,
+        exclude=args.exclude,
+        use_gitignore=args.use_gitignore,
+        reproducible=args.reproducible or args.check,
     )
 
-    merger.merge_files()
+    if batch:
+        if args.manifest:
+            batch_merger = BatchMerger.from_manifest(args.manifest, module_paths=args.module_path, **kwargs)
+        else:
+            batch_merger = BatchMerger.from_paths(args.module_path, **kwargs)
+        if not batch_merger.merge_all(check=args.check):
+            sys.exit(1)
+        return batch_merger
+
+    merger = PythonModuleMerger(module_path=args.module_path[0], module_name=args.module_name,
+                                graph_file=args.emit_graph, **kwargs)
+    if args.check:
+        if not merger.check():
+            sys.exit(1)
+    elif args.watch:
+        merger.watch(interval=args.watch_interval)
+    else:
+        merger.merge_files()
+        if merger.import_time_budget_exceeded:
+            sys.exit(1)
     return merger
 
 
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from os.path import join, dirname, abspath, isabs
+from typing import Optional
+from .cache import ParseCache
+from .color_print import info, error, success
+from .merger import PythonModuleMerger, ProcessAllStrategy, summarize_python_file
+
+
+def summarize_python_file_or_none(file_path, module_name, definitions=False):
+    """Returns None for files that fail to parse: they are parsed again, and the error raised, by their merger."""
+    try:
+        return summarize_python_file(file_path, module_name, definitions=definitions)
+    except (SyntaxError, ValueError, OSError):
+        return None
+
+
+@dataclass
+class BatchResult:
+    module_name: str
+    output_file: str
+    ok: bool
+    files: int
+    elapsed: float  # seconds
+    error: Optional[str] = None
+
+
+class BatchMerger:
+    """Merges several modules in one process.
+
+    The files of all the modules are parsed ahead in a single pool of jobs worker processes, the parse cache is shared,
+    then the modules are merged one after the other and a summary report is printed at the end.
+    """
+
+    def __init__(self, mergers: list[PythonModuleMerger], jobs: Optional[int] = 1,
+                 parse_cache: Optional[ParseCache] = None):
+        self.mergers = list(mergers)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.parse_cache = parse_cache
+        for merger in self.mergers:
+            merger.jobs = 1  # parsed ahead by the batch
+            if parse_cache:
+                merger.parse_cache = parse_cache
+        self.results: list[BatchResult] = list()
+
+    def __repr__(self):
+        return f"BatchMerger(modules={len(self.mergers)}, jobs={self.jobs})"
+
+    @classmethod
+    def from_paths(cls, module_paths, jobs: Optional[int] = 1, cache_dir=None,
+                   cache_max_size: int = 256 * 1024 * 1024, **kwargs) -> 'BatchMerger':
+        """Creates a batch of the modules at module_paths, with the same PythonModuleMerger arguments."""
+        return cls([PythonModuleMerger(module_path, **kwargs) for module_path in module_paths], jobs=jobs,
+                   parse_cache=ParseCache(cache_dir, max_size=cache_max_size) if cache_dir else None)
+
+    @classmethod
+    def from_manifest(cls, manifest_path, module_paths=(), jobs: Optional[int] = 1, cache_dir=None,
+                      cache_max_size: int = 256 * 1024 * 1024, **kwargs) -> 'BatchMerger':
+        """Creates a batch from a JSON manifest file.
+
+        The manifest is a list of modules, or an object with a "modules" list and "defaults" arguments. A module is
+        a path, or an object with a "module_path" and PythonModuleMerger arguments. Relative paths are relative to the
+        manifest directory. The modules at module_paths are added after the manifest ones.
+        """
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest, list):
+            manifest = dict(modules=manifest)
+
+        manifest_dir = dirname(abspath(manifest_path))
+        mergers = list()
+        for module in manifest['modules']:
+            manifest_kwargs = dict(manifest.get('defaults', {}),
+                                   **(dict(module_path=module) if isinstance(module, str) else module))
+            for key in ('module_path', 'output_dir', 'graph_file', 'test_scripts_dirpath', 'cache_dir'):
+                if manifest_kwargs.get(key) and not isabs(manifest_kwargs[key]):
+                    manifest_kwargs[key] = join(manifest_dir, manifest_kwargs[key])
+            if isinstance(manifest_kwargs.get('process_all_strategy'), str):
+                manifest_kwargs['process_all_strategy'] = ProcessAllStrategy[manifest_kwargs['process_all_strategy']]
+            mergers.append(PythonModuleMerger(**dict(kwargs, **manifest_kwargs)))
+        mergers.extend(PythonModuleMerger(module_path, **kwargs) for module_path in module_paths)
+        return cls(mergers, jobs=jobs,
+                   parse_cache=ParseCache(cache_dir, max_size=cache_max_size) if cache_dir else None)
+
+    def parse_all(self):
+        """Parses the files of all the modules in a single pool of worker processes."""
+        pending = list()  # (merger, file path, file stat)
+        for merger in self.mergers:
+            pending.extend((merger, file_path, file_stat)
+                           for file_path, file_stat in merger.pending_parse_files(sorted(merger.iter_files())))
+        if self.jobs <= 1 or len(pending) <= 1:
+            return
+
+        info(f"Parsing {len(pending)} python files of {len(self.mergers)} modules with "
+             f"{min(self.jobs, len(pending))} workers...")
+        with ProcessPoolExecutor(max_workers=min(self.jobs, len(pending))) as executor:
+            parse_results = executor.map(summarize_python_file_or_none, [file_path for _, file_path, _ in pending],
+                                         [merger.module_name for merger, _, _ in pending],
+                                         [merger.uses_definitions for merger, _, _ in pending],
+                                         chunksize=max(1, len(pending) // (self.jobs * 4)))
+            for (merger, file_path, file_stat), parse_result in zip(pending, parse_results):
+                if parse_result is not None:
+                    merger.store_parse_result(file_path, file_stat, parse_result)
+
+    def merge_all(self, check=False) -> bool:
+        """Merges (or checks, see PythonModuleMerger.check) all the modules, returns whether all succeeded."""
+        start_time = time.perf_counter()
+        self.results = list()
+        self.parse_all()
+        for merger in self.mergers:
+            module_start_time = time.perf_counter()
+            error_message = None
+            try:
+                ok = merger.check() if check else merger.merge_files()
+            except Exception as e:  # any failure is reported, the other modules are merged
+                ok, error_message = False, f"{type(e).__name__}: {e}"
+                error(f"Merging {merger.module_name} failed: {error_message}")
+            self.results.append(BatchResult(merger.module_name, merger.output_file, ok, len(merger.processed_files),
+                                            time.perf_counter() - module_start_time, error_message))
+        self.report(time.perf_counter() - start_time, check=check)
+        return all(result.ok for result in self.results)
+
+    def report(self, elapsed: float, check=False):
+        failed = [result for result in self.results if not result.ok]
+        status = ('up to date', 'out of date') if check else ('merged', 'failed')
+        summary = f"Batch summary: {len(self.results) - len(failed)} {status[0]}, {len(failed)} {status[1]} " \
+                  f"in {elapsed:.2f}s."
+        (error if failed else success)(summary)
+        for result in self.results:
+            line = f"  {'OK' if result.ok else 'FAILED':<6} {result.module_name:<30} {result.files:>5} files " \
+                   f"{result.elapsed:>7.2f}s  {result.error or result.output_file}"
+            (info if result.ok else error)(line)
+        if self.parse_cache:
+            info(f"Parse cache: {self.parse_cache.hits} hits, {self.parse_cache.misses} misses.")
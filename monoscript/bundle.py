@@ -0,0 +1,88 @@
+import base64
+import importlib.util
+import marshal
+import zlib
+
+BUNDLE_BOOTSTRAP_NAME = '_monoscript_bundle_bootstrap'
+
+# Installs a meta path finder serving the bundled modules from memory, then executes the package __init__ in the
+# namespace of the bundle file, which becomes the package. Run as a script, the bundle imports the package and executes
+# its __main__ instead. The code objects are used if they were marshalled by the same Python version, the sources
+# are compiled otherwise.
+BUNDLE_BOOTSTRAP_CODE = f'''def {BUNDLE_BOOTSTRAP_NAME}(namespace, package_name, magic, modules):
+    import base64
+    import importlib.abc
+    import importlib.util
+    import marshal
+    import os
+    import sys
+    import zlib
+
+    del namespace[{BUNDLE_BOOTSTRAP_NAME!r}]
+    root = package_name if namespace['__name__'] == '__main__' else namespace['__name__']
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(namespace.get('__file__') or '')), package_name)
+
+    class BundleFinder(importlib.abc.MetaPathFinder, importlib.abc.InspectLoader):
+        def _key(self, fullname):
+            if fullname == root:
+                return ''
+            return fullname[len(root) + 1:] if fullname.startswith(root + '.') else None
+
+        def find_spec(self, fullname, path=None, target=None):
+            key = self._key(fullname)
+            if key not in modules:
+                return None
+            spec = importlib.util.spec_from_loader(fullname, self, origin=os.path.join(base_dir, modules[key][1]),
+                                                   is_package=modules[key][0])
+            spec.has_location = True
+            return spec
+
+        def is_package(self, fullname):
+            return modules[self._key(fullname)][0]
+
+        def get_source(self, fullname):
+            return zlib.decompress(base64.b85decode(modules[self._key(fullname)][2])).decode('utf-8')
+
+        def get_code(self, fullname):
+            _, rel_path, _, code = modules[self._key(fullname)]
+            if magic == importlib.util.MAGIC_NUMBER:
+                return marshal.loads(zlib.decompress(base64.b85decode(code)))
+            return compile(self.get_source(fullname), package_name + '/' + rel_path, 'exec', dont_inherit=True)
+
+    finder = BundleFinder()
+    sys.meta_path.insert(0, finder)
+    if namespace['__name__'] == '__main__':
+        importlib.import_module(root)
+        if '__main__' in modules:
+            namespace['__package__'] = root
+            exec(finder.get_code(root + '.__main__'), namespace)
+        return
+
+    namespace.update(__path__=[], __package__=root)
+    if namespace.get('__spec__') is not None:
+        namespace['__spec__'].submodule_search_locations = []
+    if '' in modules:
+        exec(finder.get_code(root), namespace)
+'''
+
+
+def encode_bundle_data(data: bytes, indent: str, width=120) -> str:
+    """Returns the zlib compressed, base85 encoded data as a parenthesized string literal of lines shorter than
+    width."""
+    text = base64.b85encode(zlib.compress(data, 9)).decode('ascii')
+    chunk_size = width - len(indent) - 6
+    chunks = [text[ix:ix + chunk_size] for ix in range(0, len(text), chunk_size)] or ['']
+    return '(\n' + ''.join(f"{indent}    '{chunk}'\n" for chunk in chunks) + f"{indent})"
+
+
+def iter_bundle_code(package_name: str, modules: dict[str, tuple[bool, str, str]]):
+    """Yields the code of a bundle of modules: relative dotted name ('' for the package) -> (is_package, relative
+    path, source). The sources are compiled, a SyntaxError is raised for invalid ones."""
+    yield BUNDLE_BOOTSTRAP_CODE
+    yield "\n\n"
+    yield f"{BUNDLE_BOOTSTRAP_NAME}(globals(), {package_name!r}, {importlib.util.MAGIC_NUMBER!r}, {{\n"
+    for key, (is_package, rel_path, source) in sorted(modules.items()):
+        code = compile(source, f"{package_name}/{rel_path}", 'exec', dont_inherit=True)
+        yield f"    {key!r}: ({is_package!r}, {rel_path!r}, {encode_bundle_data(source.encode('utf-8'), ' ' * 4)}, " \
+              f"{encode_bundle_data(marshal.dumps(code), ' ' * 4)}),\n"
+    yield "})\n"
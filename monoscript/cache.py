@@ -0,0 +1,131 @@
+import hashlib
+import os
+import pickle
+from os.path import join, abspath, getsize
+from typing import Optional
+from .color_print import warning
+
+CACHE_FORMAT_VERSION = 5
+
+
+class ParseCache:
+    """On-disk cache of parse results, one pickle file per (source path, module name).
+
+    An entry is valid while the source size and mtime are unchanged, or, when they differ, while the content hash
+    is the same. Least recently used entries are evicted once the cache directory grows over max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # total size of the entries, computed on first write
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return f"ParseCache(cache_dir={self.cache_dir}, hits={self.hits}, misses={self.misses})"
+
+    def _entry_path(self, file_path, module_name):
+        key = hashlib.sha256(f"{CACHE_FORMAT_VERSION}:{module_name}:{abspath(file_path)}".encode('utf-8'))
+        return join(self.cache_dir, f"{key.hexdigest()}.pickle")
+
+    @staticmethod
+    def content_hash(code: str) -> str:
+        return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+    def get(self, file_path, module_name):
+        """Returns the cached parse result of file_path, or None if missing or stale."""
+        entry_path = self._entry_path(file_path, module_name)
+        try:
+            with open(entry_path, 'rb') as fin:
+                entry = pickle.load(fin)
+        except FileNotFoundError:
+            entry = None
+        except Exception as e:
+            warning(f"Ignoring unreadable parse cache entry {entry_path}: {e}")
+            entry = None
+
+        parse_result = self._validate(entry, file_path, module_name) if entry else None
+        if parse_result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(entry_path)  # recently used
+        except OSError:
+            pass
+        return parse_result
+
+    def _validate(self, entry, file_path, module_name):
+        if entry.get('version') != CACHE_FORMAT_VERSION or entry.get('path') != abspath(file_path) \
+                or entry.get('module_name') != module_name:
+            return None
+
+        try:
+            stat = os.stat(file_path)
+            file_stat = stat.st_size, stat.st_mtime_ns
+            if file_stat == (entry['size'], entry['mtime_ns']):
+                return entry['result']
+
+            with open(file_path, "r", encoding="utf-8") as f:
+                code = f.read()
+        except (OSError, ValueError):  # removed meanwhile or unreadable, parsed (and reported) by the merger
+            return None
+        if self.content_hash(code) == entry['hash']:  # touched but unchanged
+            self.put(file_path, module_name, entry['result'], file_stat)
+            return entry['result']
+        return None
+
+    def put(self, file_path, module_name, parse_result, file_stat: tuple[int, int]):
+        """Stores the parse result of file_path, whose (size, mtime_ns) file_stat must be taken before reading it: an
+        edit after the read is then detected."""
+        entry = dict(version=CACHE_FORMAT_VERSION, path=abspath(file_path), module_name=module_name,
+                     size=file_stat[0], mtime_ns=file_stat[1], hash=self.content_hash(parse_result.code),
+                     result=parse_result)
+        entry_path = self._entry_path(file_path, module_name)
+        old_size = getsize(entry_path) if os.path.exists(entry_path) else 0
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fou:
+                pickle.dump(entry, fou, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            warning(f"Could not write parse cache entry {entry_path}: {e}")
+            return
+
+        if self._size is None:
+            self._size = self.total_size()
+        else:
+            self._size += getsize(entry_path) - old_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def _iter_entries(self):
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.pickle') and entry.is_file():
+                    yield entry
+
+    def total_size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._iter_entries())
+
+    def evict(self, max_size: Optional[int] = None):
+        """Removes the least recently used entries until the cache is at most max_size bytes (90% of the limit)."""
+        max_size = int(self.max_size * 0.9) if max_size is None else max_size
+        entries = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                          for entry in self._iter_entries()), reverse=True)
+        size = 0
+        for mtime_ns, entry_size, entry_path in entries:
+            size += entry_size
+            if size > max_size:
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    pass
+                size -= entry_size
+        self._size = size
+
+    def clear(self):
+        self.evict(max_size=0)
@@ -0,0 +1,180 @@
+import os
+import re
+from os.path import join, dirname, exists, relpath
+from typing import Optional
+
+DEFAULT_INCLUDE = ('*.py',)
+DEFAULT_EXCLUDE = ('__pycache__/', '.*/', '*.egg-info/', 'node_modules/')
+
+
+def compile_pattern(pattern: str) -> Optional[tuple[re.Pattern, bool, bool]]:
+    """Compiles a .gitignore style pattern into (regex, negated, dir_only), or None for blank lines and comments.
+
+    The regex matches paths relative to the directory of the pattern, with '/' separators. Patterns without a slash
+    (a trailing one excepted) match at any depth, '**' matches across directories.
+    """
+    pattern = pattern.rstrip('\r\n')
+    if not pattern.strip() or pattern.startswith('#'):
+        return None
+    if not pattern.endswith('\\ '):
+        pattern = pattern.rstrip(' ')
+
+    negated = pattern.startswith('!')
+    if negated or pattern.startswith('\\'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    regex = [] if anchored else ['(?:.*/)?']
+    ix = 0
+    while ix < len(pattern):
+        if pattern.startswith('**/', ix):
+            regex.append('(?:.*/)?')
+            ix += 3
+        elif pattern.startswith('**', ix):
+            regex.append('.*')
+            ix += 2
+        elif pattern[ix] == '*':
+            regex.append('[^/]*')
+            ix += 1
+        elif pattern[ix] == '?':
+            regex.append('[^/]')
+            ix += 1
+        elif pattern[ix] == '[' and ']' in pattern[ix + 2:]:
+            end = pattern.index(']', ix + 2)
+            chars = pattern[ix + 1:end]
+            regex.append('[' + ('^' + chars[1:] if chars.startswith('!') else chars).replace('\\', '\\\\') + ']')
+            ix = end + 1
+        elif pattern[ix] == '\\' and ix + 1 < len(pattern):
+            regex.append(re.escape(pattern[ix + 1]))
+            ix += 2
+        else:
+            regex.append(re.escape(pattern[ix]))
+            ix += 1
+    return re.compile(''.join(regex), re.DOTALL), negated, dir_only
+
+
+def compile_patterns(patterns, base: str = '') -> list[tuple[str, re.Pattern, bool, bool]]:
+    """Compiles patterns into rules (base, regex, negated, dir_only), base being the relative directory they apply
+    to."""
+    rules = []
+    for pattern in patterns:
+        compiled = compile_pattern(pattern)
+        if compiled:
+            rules.append((base,) + compiled)
+    return rules
+
+
+def match_rules(rules, path: str, is_dir: bool) -> Optional[bool]:
+    """Returns whether the last rule matching path negates it (False) or not (True), None if no rule matches."""
+    matched = None
+    for base, regex, negated, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        if base:
+            if not path.startswith(base + '/'):
+                continue
+            sub_path = path[len(base) + 1:]
+        else:
+            sub_path = path
+        if regex.fullmatch(sub_path):
+            matched = not negated
+    return matched
+
+
+class FileDiscovery:
+    """Lists the files of a directory tree in a single os.scandir pass.
+
+    Files are kept if they match an include pattern and no exclude pattern. Excluded directories and virtualenvs
+    (directories with a pyvenv.cfg) are pruned before descent. Patterns use the .gitignore syntax; with use_gitignore,
+    the .gitignore files of the tree and of its parent directories, up to the repository root, are applied too.
+    """
+
+    def __init__(self, root, include=None, exclude=None, use_gitignore=False, recursive=True,
+                 default_exclude=DEFAULT_EXCLUDE):
+        self.root = root
+        self.include = compile_patterns(include or DEFAULT_INCLUDE)
+        self.exclude = compile_patterns(list(default_exclude or ()) + list(exclude or ()))
+        self.use_gitignore = use_gitignore
+        self.recursive = recursive
+
+    def __repr__(self):
+        return f"FileDiscovery(root={self.root}, use_gitignore={self.use_gitignore})"
+
+    def scan(self) -> list[str]:
+        """Returns the relative paths of the discovered files, the files of a directory before its subdirectories."""
+        files = []
+        gitignore_prefix, gitignore_rules = self._parent_gitignore_rules() if self.use_gitignore else ('', [])
+        pending = [('', gitignore_rules)]
+        while pending:
+            dir_rel_path, gitignore_rules = pending.pop()
+            dir_path = join(self.root, dir_rel_path) if dir_rel_path else self.root
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda _entry: _entry.name)
+            except OSError:
+                continue
+
+            if any(entry.name == 'pyvenv.cfg' for entry in entries) and dir_rel_path:  # vendored virtualenv
+                continue
+            if self.use_gitignore and any(entry.name == '.gitignore' for entry in entries):
+                gitignore_rules = gitignore_rules + self._read_gitignore(
+                    join(dir_path, '.gitignore'), self._join_posix(gitignore_prefix, dir_rel_path))
+
+            sub_dirs = []
+            for entry in entries:
+                rel_path = join(dir_rel_path, entry.name) if dir_rel_path else entry.name
+                posix_path = rel_path.replace(os.sep, '/')
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and not self.recursive:
+                    continue
+                if match_rules(self.exclude, posix_path, is_dir) or \
+                        gitignore_rules and match_rules(gitignore_rules, self._join_posix(gitignore_prefix, posix_path),
+                                                        is_dir):
+                    continue
+                if is_dir:
+                    sub_dirs.append((rel_path, gitignore_rules))
+                elif match_rules(self.include, posix_path, False) and entry.is_file():
+                    files.append(rel_path)
+            pending.extend(reversed(sub_dirs))
+        return files
+
+    def iter_paths(self):
+        for rel_path in self.scan():
+            yield join(self.root, rel_path)
+
+    @staticmethod
+    def _join_posix(prefix, rel_path):
+        rel_path = rel_path.replace(os.sep, '/')
+        return f"{prefix}/{rel_path}" if prefix and rel_path else prefix or rel_path
+
+    def _parent_gitignore_rules(self):
+        """Returns the path of the root relative to the repository root, and the rules of the parents .gitignore."""
+        root = os.path.abspath(self.root)
+        parents = []
+        parent = dirname(root)
+        while True:
+            parents.append(parent)
+            if exists(join(parent, '.git')) or dirname(parent) == parent:
+                break
+            parent = dirname(parent)
+        if exists(join(root, '.git')) or not exists(join(parents[-1], '.git')):  # not in a repository
+            return '', []
+
+        repo_root = parents[-1]
+        rules = []
+        for parent in reversed(parents):
+            gitignore_path = join(parent, '.gitignore')
+            if exists(gitignore_path):
+                rules.extend(self._read_gitignore(gitignore_path, relpath(parent, repo_root).replace(os.sep, '/')))
+        return relpath(root, repo_root).replace(os.sep, '/'), rules
+
+    @staticmethod
+    def _read_gitignore(gitignore_path, base):
+        try:
+            with open(gitignore_path, 'r', encoding='utf-8') as f:
+                return compile_patterns(f.readlines(), base='' if base == '.' else base)
+        except OSError:
+            return []
@@ -0,0 +1,118 @@
+import json
+from typing import Optional
+
+
+class ImportGraph:
+    """Internal import graph of a module: files (relative paths) and the files they import, in import order."""
+
+    def __init__(self):
+        self.imports: dict[str, list[str]] = dict()  # rel_path -> imported rel_paths
+
+    def __repr__(self):
+        return f"ImportGraph(files={len(self.imports)}, imports={sum(len(v) for v in self.imports.values())})"
+
+    def __contains__(self, rel_path):
+        return rel_path in self.imports
+
+    def __len__(self):
+        return len(self.imports)
+
+    def add_file(self, rel_path: str):
+        self.imports.setdefault(rel_path, list())
+
+    def add_import(self, rel_path: str, imported_rel_path: str):
+        self.add_file(rel_path)
+        self.add_file(imported_rel_path)
+        if imported_rel_path not in self.imports[rel_path]:
+            self.imports[rel_path].append(imported_rel_path)
+
+    def importers(self, rel_path: str) -> list[str]:
+        return [importer for importer, imported in self.imports.items() if rel_path in imported]
+
+    def topological_order(self, roots: Optional[list[str]] = None) -> list[str]:
+        """Returns the files with every file after the files it imports (depth-first post-order from roots).
+
+        Files not reachable from roots follow in insertion order. Import cycles are broken at the import that closes
+        them, see find_cycles.
+        """
+        order = list()
+        visited = set()
+        for root in list(roots or ()) + list(self.imports):
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self.imports[root]))]
+            while stack:
+                rel_path, imports = stack[-1]
+                for imported_rel_path in imports:
+                    if imported_rel_path not in visited:
+                        visited.add(imported_rel_path)
+                        stack.append((imported_rel_path, iter(self.imports[imported_rel_path])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(rel_path)
+        return order
+
+    def find_cycles(self) -> list[list[str]]:
+        """Returns the import cycles, as the sorted files of each strongly connected component (Tarjan)."""
+        indexes, low_links = dict(), dict()
+        component_stack, on_stack = list(), set()
+        cycles = list()
+        for root in self.imports:
+            if root in indexes:
+                continue
+            indexes[root] = low_links[root] = len(indexes)
+            component_stack.append(root)
+            on_stack.add(root)
+            stack = [(root, iter(self.imports[root]))]
+            while stack:
+                rel_path, imports = stack[-1]
+                for imported_rel_path in imports:
+                    if imported_rel_path not in indexes:
+                        indexes[imported_rel_path] = low_links[imported_rel_path] = len(indexes)
+                        component_stack.append(imported_rel_path)
+                        on_stack.add(imported_rel_path)
+                        stack.append((imported_rel_path, iter(self.imports[imported_rel_path])))
+                        break
+                    if imported_rel_path in on_stack:
+                        low_links[rel_path] = min(low_links[rel_path], indexes[imported_rel_path])
+                else:
+                    stack.pop()
+                    if stack:
+                        parent = stack[-1][0]
+                        low_links[parent] = min(low_links[parent], low_links[rel_path])
+                    if low_links[rel_path] == indexes[rel_path]:
+                        component = list()
+                        while True:
+                            member = component_stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == rel_path:
+                                break
+                        if len(component) > 1 or rel_path in self.imports[rel_path]:
+                            cycles.append(sorted(component))
+        return sorted(cycles)
+
+    def to_dict(self) -> dict:
+        return dict(files=list(self.imports), imports={rel_path: list(imports)
+                                                       for rel_path, imports in self.imports.items()},
+                    order=self.topological_order(), cycles=self.find_cycles())
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_dot(self) -> str:
+        lines = ['digraph imports {']
+        lines.extend(f'  {json.dumps(rel_path)};' for rel_path in self.imports)
+        for rel_path, imports in self.imports.items():
+            lines.extend(f'  {json.dumps(rel_path)} -> {json.dumps(imported_rel_path)};'
+                         for imported_rel_path in imports)
+        lines.append('}\n')
+        return '\n'.join(lines)
+
+    def write(self, file_path: str):
+        """Writes the graph to file_path, in DOT format for .dot/.gv files, in JSON otherwise."""
+        content = self.to_dot() if file_path.endswith(('.dot', '.gv')) else self.to_json()
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(content)
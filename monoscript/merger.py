@@ -1,15 +1,29 @@
 import datetime
+import hashlib
+import importlib.util
+import marshal
 import os
 import subprocess
 import sys
+import time
 from collections import defaultdict
-from os.path import join, dirname, basename, abspath, exists, relpath, isfile, isdir, normpath
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from os.path import join, dirname, basename, abspath, exists, relpath, isdir, normpath
 import ast
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import Union, Optional
+from .bundle import iter_bundle_code, encode_bundle_data
+from .cache import ParseCache
 from .color_print import info, error, warning, success
-from .parser import ScriptParser, ScriptNode
+from .discovery import FileDiscovery
+from .graph import ImportGraph
+from .minify import minify_code, MinifyReport
+from .profiling import profile_import, ImportProfile
+from .targets import compile_pyc, build_zipapp, validate_target
+from .parser import ScriptParser, ScriptNode, SourceBuffer, is_internal_import, split_lines
+from .writer import AtomicWriter, file_hash
 
 
 class ProcessAllStrategy(Enum):
@@ -36,7 +50,55 @@ class PythonModuleMerger:
                  test_scripts_dirpath=None,  # or join(module_parent, test_scripts_dirname)
                  merge_test_scripts=False,  # True, False;
                  run_test_scripts=None,  # True, False or None (Auto: if test_scripts_dirpath exists);
+                 test_jobs: Optional[int] = 1,  # test scripts run concurrently, None or 0: cpu count
+                 test_timeout: Optional[float] = None,  # seconds, per test script
 
+                 # parse cache
+                 cache_dir=None,
+                 cache_max_size: int = 256 * 1024 * 1024,
+
+                 # parallel parsing
+                 jobs: Optional[int] = 1,  # number of worker processes, None or 0: cpu count
+
+                 # import graph
+                 graph_file=None,  # JSON or DOT (.dot, .gv) file the internal import graph is written to
+
+                 # file discovery
+                 include: Optional[list[str]] = None,  # .gitignore style patterns, default: *.py
+                 exclude: Optional[list[str]] = None,
+                 use_gitignore=False,
+
+                 # reproducible output
+                 reproducible=False,  # omit the generation time, unless SOURCE_DATE_EPOCH is set
+
+                 # lazy imports
+                 lazy_imports=False,  # third-party 'import x' statements load x on first use (organized imports)
+
+                 # import profiling
+                 profile_import=False,
+                 import_time_budget: Optional[float] = None,  # milliseconds, the merge fails if exceeded
+                 profile_top=10,
+
+                 # tree-shaking
+                 tree_shake=False,  # drop the top-level functions and classes no exported name reaches
+
+                 # unused imports
+                 remove_unused_imports=False,  # drop the organized imports binding names no segment loads
+                 keep_imports: Optional[list[str]] = None,  # modules imported for their side effects
+
+                 # minification
+                 minify=0,  # level, see minify.MINIFY_LEVELS
+
+                 # output targets, built from the output file
+                 pyc=False,  # hash-based .pyc in the __pycache__ directory of the output file
+                 zipapp=False,  # <module_name>.pyz, with the precompiled module
+                 zipapp_interpreter: Optional[str] = '/usr/bin/env python3',  # shebang line, None: not executable
+
+                 # bundle mode
+                 bundle=False,  # marshalled code of each file served by an embedded finder, instead of merged code
+
+                 # lazy segments
+                 lazy_segments=False,  # segments run on first access to one of their names (module __getattr__)
                  ):
         self.module_path = abspath(module_path)
         self.module_parent = dirname(self.module_path)
@@ -51,10 +113,14 @@ class PythonModuleMerger:
         self.all_other_explicit_entries = set()
         self.all_init_explicit_entries = set()
         self.all_init_implicit_entries = set()
-        self.all_external_imports = set()
+        self.all_external_imports: list[Union[ast.Import, ast.ImportFrom]] = []  # in processing order
         self.processed_code: list[tuple[FileParseResult, str]] = []
         self.processed_files = set()
 
+        # parse results kept in memory between merges (watch mode): path -> ((size, mtime_ns), parse result)
+        self.parsed_files: dict[str, tuple[tuple[int, int], FileParseResult]] = {}
+        self.module_code_hash = None  # of the last merged code, without the module docstring
+
         # metadata
         self.module_description = module_description
         self.module_version = module_version
@@ -71,229 +137,652 @@ class PythonModuleMerger:
             else run_test_scripts
         self.merge_test_scripts = merge_test_scripts
         self.test_merger = None
+        self.test_jobs = test_jobs or os.cpu_count() or 1
+        self.test_timeout = test_timeout
+        self.test_results: list[TestScriptResult] = []
 
         # global names
         self.global_context = {}
         self.global_context_conflicts = defaultdict(set)
 
+        # parse cache
+        self.parse_cache = ParseCache(cache_dir, max_size=cache_max_size) if cache_dir else None
+
+        # parallel parsing
+        self.jobs = jobs or os.cpu_count() or 1
+
+        # import graph
+        self.import_graph = ImportGraph()
+        self.graph_file = graph_file
+        self.module_map: Optional[dict[str, str]] = None  # dotted module name -> file path, built once per merge
+
+        # file discovery
+        self.exclude = exclude or []
+        self.use_gitignore = use_gitignore
+        self.discovery = FileDiscovery(self.module_path, include=include, exclude=exclude, use_gitignore=use_gitignore)
+        self.discovered_files: Optional[list[str]] = None  # relative paths, scanned once per merge
+
+        # reproducible output
+        self.reproducible = reproducible
+
+        # lazy imports
+        self.lazy_imports = lazy_imports
+        if lazy_imports and STDLIB_MODULE_NAMES is None:
+            raise ValueError("lazy_imports requires Python 3.10 or later, to tell the standard library modules apart")
+
+        # import profiling
+        self.profile_import = profile_import or import_time_budget is not None
+        self.import_time_budget = import_time_budget
+        self.profile_top = profile_top
+        self.import_profile: Optional[ImportProfile] = None
+        self.import_time_budget_exceeded = False
+        if self.profile_import and (minify or lazy_segments or bundle):  # their output has no segment markers
+            raise ValueError("profile_import cannot be combined with minify, lazy_segments and bundle")
+
+        # tree-shaking
+        self.tree_shake = tree_shake
+        self.used_names: Optional[set[str]] = None  # names reachable from the roots, when tree-shaking
+        self.removed_definitions: dict[str, list[Definition]] = {}  # rel_path -> unreachable definitions
+
+        # unused imports
+        self.remove_unused_imports = remove_unused_imports or tree_shake
+        self.keep_imports = set(keep_imports or [])
+        self.removed_imports: list[str] = []  # unparsed import statements left out of the output
+
+        # minification
+        self.minify = minify
+        self.minify_report: Optional[MinifyReport] = None  # of the last generated code
+
+        # output targets
+        self.pyc = pyc
+        self.pyc_file = importlib.util.cache_from_source(self.output_file)
+        self.zipapp = zipapp
+        self.zipapp_file = join(output_dir, f"{self.module_name}.pyz")
+        self.zipapp_interpreter = zipapp_interpreter
+
+        # bundle mode
+        self.bundle = bundle
+        if bundle and (tree_shake or remove_unused_imports or minify or lazy_imports or lazy_segments):
+            raise ValueError("bundle cannot be combined with tree_shake, remove_unused_imports, minify, lazy_imports "
+                             "and lazy_segments")
+
+        # lazy segments
+        self.lazy_segments = lazy_segments
+
+    def discover_files(self) -> list[str]:
+        """Returns the relative paths of the module files, scanned once per merge."""
+        if self.discovered_files is None:
+            self.discovered_files = self.discovery.scan()
+        return self.discovered_files
+
     def iter_files(self):
-        for root, _, files in os.walk(self.module_path):
-            for filename in sorted(files):
-                if filename.endswith(".py"):
-                    file_path = join(root, filename)
-                    rel_path = relpath(file_path, self.module_path)
-                    if rel_path in self.processed_files:
-                        continue
-                    yield file_path
-
-    def merge_files(self):
+        for rel_path in self.discover_files():
+            yield join(self.module_path, rel_path)
+
+    def reset(self):
+        """Clears the state of the previous merge, parse results kept in memory excepted."""
+        self.all_other_explicit_entries = set()
+        self.all_init_explicit_entries = set()
+        self.all_init_implicit_entries = set()
+        self.all_external_imports = []
+        self.processed_code = []
+        self.processed_files = set()
+        self.global_context = {}
+        self.global_context_conflicts = defaultdict(set)
+        self.import_graph = ImportGraph()
+        self.module_map = None
+        self.discovered_files = None
+        self.used_names = None
+        self.removed_definitions = {}
+        self.removed_imports = []
+
+    def merge_files(self, write_unchanged=True):
         """Merges all Python files into a single file while handling imports and '__all__'."""
-        # Process __init__.py first (to extract __all__)
-        info(f"Started processing files in {self.module_path}...")
-        init_file = join(self.module_path, "__init__.py")
-        main_file = join(self.module_path, "__main__.py")
+        self.process_files()
+
+        # Stream to a temporary file renamed over the output file, unless its content is the same
+        module_code_hash = hashlib.sha256()
+        with AtomicWriter(self.output_file, skip_unchanged=True) as writer:
+            writer.write(self.generate_module_docstring())
+            for segment in self.iter_module_code():
+                writer.write(segment)
+                module_code_hash.update(segment.encode('utf-8'))
+            if not write_unchanged and module_code_hash.hexdigest() == self.module_code_hash \
+                    and exists(self.output_file):
+                writer.discard()
+        self.module_code_hash = module_code_hash.hexdigest()
+        if writer.discarded:
+            info(f"Merged code unchanged, {self.output_file} left untouched.")
+            return True
+        elif writer.unchanged:
+            info(f"Output unchanged, {self.output_file} left untouched.")
+        else:
+            success(f"Module merged successfully into {self.output_file}!")
+        if self.minify_report:
+            info(str(self.minify_report))
+        self.write_targets()
 
-        if exists(main_file):
-            self.process_file(main_file)
+        # profile import time
+        profile_ok = self.run_import_profile() if self.profile_import else True
 
-        if exists(init_file) and "__init__.py" not in self.processed_files:
-            self.process_file(init_file)
+        # generate and run tests
+        if self.run_test_scripts:
+            return self.generate_and_run_tests() and profile_ok
+        return profile_ok
+
+    def check(self) -> bool:
+        """Merges the module in memory and returns whether the output file is up to date."""
+        self.process_files()
+        code_hash = hashlib.sha256(self.generate_module_docstring().encode('utf-8'))
+        for segment in self.iter_module_code():
+            code_hash.update(segment.encode('utf-8'))
+        up_to_date = exists(self.output_file) and file_hash(self.output_file) == code_hash.hexdigest()
+        if up_to_date:
+            for target_file, content in self.generate_targets():
+                if not exists(target_file) or file_hash(target_file) != hashlib.sha256(content).hexdigest():
+                    error(f"{target_file} is out of date.")
+                    return False
+            success(f"{self.output_file} is up to date.")
+        else:
+            error(f"{self.output_file} is out of date.")
+        return up_to_date
 
-        for file_path in self.iter_files():
-            self.process_file(file_path, append=True)
+    def process_files(self):
+        """Parses the module files and processes them in dependency order, without writing anything."""
+        self.reset()
 
-        success(f"Successfully processed {len(self.processed_files)} python files.")
-        final_code = self.generate_code()
+        # Parse files ahead in worker processes
+        if self.jobs > 1:
+            self.parse_files(sorted(self.iter_files()))
 
-        # Write to output file
-        os.makedirs(self.output_dir, exist_ok=True)
-        with open(self.output_file, "w", encoding="utf-8") as f:
-            f.write(final_code)
+        info(f"Started processing files in {self.module_path}...")
+        self.import_graph = self.build_import_graph()
+        for cycle in self.import_graph.find_cycles():
+            warning(f"Import cycle between {', '.join(cycle)}: some names may be used before being defined.")
+        if self.graph_file:
+            self.import_graph.write(self.graph_file)
+            info(f"Import graph written to {self.graph_file}.")
+
+        # Process files in dependency order: __init__.py first, __main__.py last
+        roots = list(self.discover_files())
+        roots.sort(key=lambda _rel_path: (_rel_path != "__init__.py", _rel_path == "__main__.py"))
+        for rel_path in self.import_graph.topological_order(roots=roots):
+            if self.bundle:  # files keep their own namespace
+                self.processed_code.append((self.parse_python_file(join(self.module_path, rel_path)), rel_path))
+                self.processed_files.add(rel_path)
+            else:
+                self.process_file(normpath(join(self.module_path, rel_path)))
 
-        success(f"Module merged successfully into {self.output_file}!")
+        success(f"Successfully processed {len(self.processed_files)} python files.")
+        if self.tree_shake:
+            self.shake_tree()
+        elif self.remove_unused_imports:
+            self.used_names = self.collect_used_names()
+        if self.parse_cache:
+            info(f"Parse cache: {self.parse_cache.hits} hits, {self.parse_cache.misses} misses.")
+
+    def watch(self, interval=1.0, max_merges=None):
+        """Merges the module, then polls its files and re-merges each time one of them changes.
+
+        Only changed files are parsed again, the output file is rewritten only if the merged code changed. Merges that
+        failed on a file being saved (removed, renamed or half written by an editor) are retried on the next poll.
+        Runs until interrupted, or until max_merges merges were done.
+        """
+        files_stats = self.stat_files()
+        self.merge_files()
+        merges = 1
+        info(f"Watching {self.module_path} for changes (Ctrl+C to stop)...")
+        try:
+            while max_merges is None or merges < max_merges:
+                time.sleep(interval)
+                new_files_stats = self.stat_files()
+                if new_files_stats == files_stats:
+                    continue
 
-        # generate and run tests
-        if self.run_test_scripts:
-            return self.generate_and_run_tests()
-        return True
+                changed_files = sorted(path for path in set(files_stats).union(new_files_stats)
+                                       if files_stats.get(path) != new_files_stats.get(path))
+                info(f"Detected changes in {', '.join(relpath(path, self.module_path) for path in changed_files)}")
+                files_stats = new_files_stats
+                for path in changed_files:
+                    self.parsed_files.pop(path, None)
+                try:
+                    self.merge_files(write_unchanged=False)
+                except (SyntaxError, ImportConflictException) as e:
+                    error(f"Merge failed: {e}")
+                except (OSError, ValueError) as e:  # e.g. FileNotFoundError, UnicodeDecodeError
+                    error(f"Merge failed, retrying: {type(e).__name__}: {e}")
+                    for path in changed_files:  # seen as changed again on the next poll
+                        files_stats.pop(path, None)
+                merges += 1
+        except KeyboardInterrupt:
+            info("Stopped watching.")
+
+    def stat_files(self) -> dict[str, tuple[int, int]]:
+        """Returns the (size, mtime_ns) of every python file of the module."""
+        files_stats = {}
+        for file_path in self.discovery.iter_paths():
+            try:
+                stat = os.stat(file_path)
+            except OSError:  # removed meanwhile
+                continue
+            files_stats[file_path] = stat.st_size, stat.st_mtime_ns
+        return files_stats
 
     def generate_code(self):
         # header and metadata
-        merged_code = [self.generate_module_docstring()]
+        return self.generate_module_docstring() + self.generate_module_code()
+
+    def generate_module_code(self):
+        return ''.join(self.iter_module_code())
+
+    def iter_module_code(self):
+        """Yields the merged code, without the module docstring, segment by segment."""
+        if self.bundle:
+            yield from iter_bundle_code(self.module_name, self.collect_bundle_modules())
+            return
+
+        self.minify_report = MinifyReport() if self.minify else None
+        blank_lines = "" if self.minify else "\n\n"
 
         # __all__
         all_node = self.generate_all_node()
         if all_node:
-            merged_code.append(ast.unparse(ast.fix_missing_locations(all_node)))
-            merged_code.append("\n\n")
+            yield ast.unparse(ast.fix_missing_locations(all_node))
+            yield "\n" + blank_lines[1:]
 
         # top level imports if organized
         if self.organize_imports:
             try:
                 top_level_imports = self.organize_to_level_imports()
+                if self.remove_unused_imports:
+                    top_level_imports = self.filter_unused_imports(top_level_imports)
+                lazy_imports = []
+                if self.lazy_imports:
+                    lazy_imports = [node for node in top_level_imports if self.is_lazy_import(node)]
+                    top_level_imports = [node for node in top_level_imports if not self.is_lazy_import(node)]
                 if top_level_imports:
-                    merged_code.extend([ast.unparse(node) + "\n" for node in top_level_imports])
-                    merged_code.append("\n\n")
+                    for node in top_level_imports:
+                        yield ast.unparse(node) + "\n"
+                    yield blank_lines
+                if lazy_imports:
+                    yield self.minify_segment(LAZY_IMPORT_FUNCTION_CODE, '<lazy imports>') + "\n" \
+                        if self.minify else LAZY_IMPORT_FUNCTION_CODE
+                    yield blank_lines
+                    for node in lazy_imports:
+                        yield self.generate_lazy_import_code(node) + "\n"
+                    yield blank_lines
             except ImportConflictException as e:
                 error(str(e))
                 raise
 
-        # TODO: some code reordering
-
         # code
+        lazy_segments = self.lazy_segments
+        segment_names = {}  # rel_path -> names bound by the segment, lazy segments only
+        if lazy_segments:
+            segment_names = self.collect_segment_names()
+            if any({'__getattr__', '__dir__'} & names for names in segment_names.values()):
+                warning("The module defines a module level __getattr__ or __dir__, lazy segments disabled.")
+                lazy_segments = False
+            else:
+                yield LAZY_SEGMENTS_CODE.replace('MODULE_NAME', self.module_name)
+                yield blank_lines
+
         for parse_result, rel_path in self.processed_code:
             # TODO replace internal_imports_all as with assignment
 
-            # remove some elements
-            elements_to_remove = parse_result.internal_imports_all + parse_result.all_nodes
-            if self.organize_imports:
-                elements_to_remove += parse_result.external_imports_nodes
-
-            for node in set(elements_to_remove):
-                node.remove()
-
-            merged_code.append(f"# --- Start of {rel_path} ---\n")
-            code = parse_result.root_node.get_code() if parse_result.root_node else None
+            code = parse_result.get_code(remove_external_imports=self.organize_imports,
+                                         removed_spans=[definition.span for definition in
+                                                        self.removed_definitions.get(rel_path, ())])
+            if self.minify and code.strip():
+                code = self.minify_segment(code, rel_path)
+            if lazy_segments and rel_path in segment_names:
+                code = self.generate_lazy_segment_code(parse_result, rel_path, code, segment_names)
+            if self.minify:  # without the segment markers
+                if code.strip():
+                    yield code + "\n"
+                continue
+
+            yield f"# --- Start of {rel_path} ---\n"
             if not code or not code.strip():
-                # merged_code.append("# --- empty file")
+                # yield "# --- empty file"
                 pass
             else:
-                merged_code.append(code)
-            merged_code.append(f"\n# --- End of {rel_path} ---\n")
-            merged_code.append("\n\n")
+                yield code
+            yield f"\n# --- End of {rel_path} ---\n"
+            yield "\n\n"
+
+        if lazy_segments:
+            yield self.generate_lazy_segments_runs(segment_names)
+
+    def collect_segment_names(self) -> dict[str, set[str]]:
+        """Returns the names bound at the top level of each segment, empty segments excepted."""
+        segment_names = {}
+        for parse_result, rel_path in self.processed_code:
+            code = parse_result.get_code(remove_external_imports=self.organize_imports,
+                                         removed_spans=[definition.span for definition in
+                                                        self.removed_definitions.get(rel_path, ())])
+            if code.strip():
+                symbols = ScriptParser(code, statements_only=True).parse().symbols
+                segment_names[rel_path] = set(symbols.module.definitions)
+        return segment_names
+
+    def generate_lazy_segment_code(self, parse_result: 'FileParseResult', rel_path: str, code: str,
+                                   segment_names: dict[str, set[str]]) -> str:
+        """Returns the registration of a segment run on first access to one of its names, after the segments it
+        imports. The __init__.py segment runs after the segments providing the names it uses."""
+        if rel_path == '__init__.py':
+            used_names = set(parse_result.references)
+            for definition in parse_result.definitions:
+                used_names.update(definition.references)
+            dependencies = [other_rel_path for other_rel_path, names in segment_names.items()
+                            if other_rel_path != rel_path and used_names & names]
+        else:
+            dependencies = list(self.import_graph.imports.get(rel_path, ()))
+        # the imports of function bodies are removed too, their names must be bound when the functions are called
+        nested_import_paths, _ = self.process_internal_imports(join(self.module_path, rel_path),
+                                                               parse_result.nested_internal_imports)
+        for path in nested_import_paths:
+            dependency = relpath(path, self.module_path)
+            if dependency not in dependencies and dependency != rel_path:
+                dependencies.append(dependency)
+
+        code = code.strip('\n') + '\n'  # a raw string literal can hold it if it has no triple quotes
+        if "'''" not in code:
+            source, literal = '\n' + code, f"r'''\n{code}'''"
+        elif '"""' not in code:
+            source, literal = '\n' + code, f'r"""\n{code}"""'
+        else:
+            source, literal = code, repr(code)
+        code_object = compile(source, f"{self.module_name}/{rel_path}", 'exec', dont_inherit=True)
+        return f"{LAZY_SEGMENT_FUNCTION_NAME}({rel_path!r}, {tuple(dependencies)!r}, " \
+               f"{tuple(sorted(segment_names[rel_path]))!r}, {literal}, " \
+               f"{encode_bundle_data(marshal.dumps(code_object), '')})"
 
-        return ''.join(merged_code)
+    @staticmethod
+    def generate_lazy_segments_runs(segment_names: dict[str, set[str]]) -> str:
+        """Returns the code running the segments nothing would trigger: __init__.py, the segments binding no name, and
+        __main__.py when run as a script."""
+        eager_segments = [rel_path for rel_path, names in segment_names.items()
+                          if rel_path == '__init__.py' or not names and rel_path != '__main__.py']
+        lines = [f"{LAZY_SEGMENT_RUN_FUNCTION_NAME}({rel_path!r})\n" for rel_path in eager_segments]
+        if '__main__.py' in segment_names:
+            lines.append(f"if __name__ == '__main__':\n    {LAZY_SEGMENT_RUN_FUNCTION_NAME}('__main__.py')\n")
+        return ''.join(lines)
+
+    def collect_bundle_modules(self) -> dict[str, tuple[bool, str, str]]:
+        """Returns the processed files by dotted name relative to the package: (is_package, relative path, source).
+
+        Directories without an __init__.py are bundled as empty packages.
+        """
+        if self.module_map is None:
+            self.module_map = self.build_module_map()
+        parse_results = {rel_path: parse_result for parse_result, rel_path in self.processed_code}
+        modules = {}
+        for name, file_path in self.module_map.items():
+            rel_path = relpath(file_path, self.module_path)
+            if rel_path not in parse_results:
+                continue
+            key = name[len(self.module_name) + 1:]
+            modules[key] = (basename(rel_path) == '__init__.py', rel_path.replace(os.sep, '/'),
+                            parse_results[rel_path].code)
+            parts = key.split('.')
+            for ix in range(len(parts) - 1, -1, -1):
+                parent_key = '.'.join(parts[:ix])
+                if parent_key not in modules:
+                    modules[parent_key] = (True, '/'.join(parts[:ix] + ['__init__.py']), '')
+        return modules
+
+    def minify_segment(self, code: str, rel_path: str) -> str:
+        """Returns the code of a segment minified at the minify level, and adds it to minify_report."""
+        try:
+            minified_code, level = minify_code(code, self.minify)
+        except SyntaxError as e:
+            warning(f"Could not minify {rel_path}, left as is: {e}")
+            return code
+        if level < self.minify:
+            warning(f"Could not minify {rel_path} at level {self.minify}, minified at level {level}.")
+        self.minify_report.add(code, minified_code)
+        return minified_code
+
+    @property
+    def uses_definitions(self) -> bool:
+        """Whether the merge uses the definitions and references of the parse results, see summarize_definitions."""
+        return bool(self.tree_shake or self.remove_unused_imports or self.lazy_segments)
 
     def parse_python_file(self, file_path) -> 'FileParseResult':
         """Parses a Python file and extracts valid code while handling imports, '__all__', and redundant entries."""
-        with open(file_path, "r", encoding="utf-8") as f:
-            code = f.read()
+        stat = os.stat(file_path)
+        file_stat = stat.st_size, stat.st_mtime_ns
+        if file_path in self.parsed_files and self.parsed_files[file_path][0] == file_stat:
+            return self.parsed_files[file_path][1]
+
+        parse_result = self._parse_python_file(file_path, file_stat)
+        self.parsed_files[file_path] = file_stat, parse_result
+        return parse_result
+
+    def parse_files(self, file_paths):
+        """Parses files ahead of processing, in jobs worker processes, and keeps the results in memory."""
+        pending = self.pending_parse_files(file_paths)
+        if not pending:
+            return
+
+        info(f"Parsing {len(pending)} python files with {min(self.jobs, len(pending))} workers...")
+        with ProcessPoolExecutor(max_workers=min(self.jobs, len(pending))) as executor:
+            parse_results = executor.map(summarize_python_file, [file_path for file_path, _ in pending],
+                                         repeat(self.module_name), repeat(self.uses_definitions),
+                                         chunksize=max(1, len(pending) // (self.jobs * 4)))
+            for (file_path, file_stat), parse_result in zip(pending, parse_results):
+                self.store_parse_result(file_path, file_stat, parse_result)
+
+    def pending_parse_files(self, file_paths) -> list[tuple[str, tuple[int, int]]]:
+        """Returns the (path, (size, mtime_ns)) of the files that are neither parsed in memory nor in the cache."""
+        pending = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            file_stat = stat.st_size, stat.st_mtime_ns
+            if file_path in self.parsed_files and self.parsed_files[file_path][0] == file_stat:
+                continue
+            parse_result = self.parse_cache.get(file_path, self.module_name) if self.parse_cache else None
+            if parse_result is not None:
+                self.parsed_files[file_path] = file_stat, parse_result
+            else:
+                pending.append((file_path, file_stat))
+        return pending
 
-        explicit_all_entries = set()
-        all_nodes = list()
-        external_imports_nodes = list()
-        internal_imports_nodes = list()
-        internal_imports_all = list()
+    def store_parse_result(self, file_path, file_stat: tuple[int, int], parse_result: 'FileParseResult'):
+        self.parsed_files[file_path] = file_stat, parse_result
+        if self.parse_cache:
+            self.parse_cache.put(file_path, self.module_name, parse_result, file_stat)
 
-        if not code or not code.strip():
-            return FileParseResult(root_node=None, explicit_all_entries=explicit_all_entries, all_nodes=all_nodes,
-                                   external_imports_nodes=external_imports_nodes,
-                                   internal_imports_nodes=internal_imports_nodes,
-                                   internal_imports_all=internal_imports_all)
+    def _parse_python_file(self, file_path, file_stat: tuple[int, int]) -> 'FileParseResult':
+        if self.parse_cache:
+            parse_result = self.parse_cache.get(file_path, self.module_name)
+            if parse_result is not None:
+                return parse_result
 
-        parser = ScriptParser(code)
-        root_node = parser.parse()
+        with open(file_path, "r", encoding="utf-8") as f:
+            code = f.read()
 
-        # look for __all__ & imports in top level statements
-        for node in root_node.children:
-            if isinstance(node.node, (ast.Import, ast.ImportFrom)):  # process top-level imports
-                if node.is_internal_import(self.module_name):
-                    internal_imports_nodes.append(node)
-                else:
-                    external_imports_nodes.append(node)
-            extracted_all_names = node.extract_all_names()
-            if extracted_all_names is not None:
-                explicit_all_entries.update(extracted_all_names)
-                all_nodes.append(node)
-
-        # remove internal imports
-        for node in root_node.walk():
-            if node.is_internal_import(self.module_name):
-                internal_imports_all.append(node)
-
-        return FileParseResult(root_node=root_node, explicit_all_entries=explicit_all_entries, all_nodes=all_nodes,
-                               external_imports_nodes=external_imports_nodes,
-                               internal_imports_nodes=internal_imports_nodes, internal_imports_all=internal_imports_all)
-
-    def process_file(self, file_path, append=False):
+        parse_result = self.parse_python_code(code)
+        if self.parse_cache:
+            self.parse_cache.put(file_path, self.module_name, parse_result, file_stat)
+        return parse_result
+
+    def parse_python_code(self, code) -> 'FileParseResult':
+        return summarize_python_code(code, self.module_name, definitions=self.uses_definitions)
+
+    def build_import_graph(self) -> ImportGraph:
+        """Parses the module files and the files they import, and returns their internal import graph."""
+        graph = ImportGraph()
+        parsed = set()
+        pending = list(reversed(list(self.iter_files())))
+        while pending:
+            file_path = pending.pop()
+            rel_path = relpath(file_path, self.module_path)
+            if rel_path in parsed:
+                continue
+            parsed.add(rel_path)
+            graph.add_file(rel_path)
+            parse_result = self.parse_python_file(file_path)
+            import_paths, _ = self.process_internal_imports(file_path, parse_result.internal_imports)
+            for path in import_paths:
+                graph.add_import(rel_path, relpath(path, self.module_path))
+                pending.append(path)
+        return graph
+
+    def process_file(self, file_path):
         rel_path = relpath(file_path, self.module_path)
         parse_result: FileParseResult = self.parse_python_file(file_path)
-        import_paths, imported_names = self.process_internal_imports(file_path, parse_result.internal_imports_nodes)
         if rel_path == '__init__.py':
+            _, imported_names = self.process_internal_imports(file_path, parse_result.internal_imports)
             self.all_init_explicit_entries.update(parse_result.explicit_all_entries)
             self.all_init_implicit_entries = imported_names
         else:
             self.all_other_explicit_entries.update(parse_result.explicit_all_entries)
 
-        self.all_external_imports.update(script_node.node for script_node in parse_result.external_imports_nodes)
+        self.all_external_imports.extend(parse_result.external_imports)
 
         # global names warnings
         self.check_global_names(parse_result, rel_path)
 
         # processed code
-        if append:
-            self.processed_code.append((parse_result, rel_path))
-        else:
-            self.processed_code.insert(0, (parse_result, rel_path))
+        if self.uses_definitions:
+            parse_result.summarize_definitions()
+        self.processed_code.append((parse_result, rel_path))
         self.processed_files.add(rel_path)
 
-        # process next paths:
-        # TODO: some code reordering??
-        for path in import_paths:
-            rel_path = relpath(path, self.module_path)
-            if rel_path not in self.processed_files:
-                self.process_file(path)
+    def shake_tree(self):
+        """Finds the top-level functions and classes that are not reachable, and the names that are.
 
-    def check_global_names(self, parse_result, rel_path):
-        if parse_result.root_node and parse_result.root_node.context:
-            for name, script_node in parse_result.root_node.context.items():
-                # ignore _
-                if name == '_':
-                    continue
+        The roots are the final '__all__' names (all public names without '__all__'), __main__.py, the names loaded by
+        the other top-level statements, the module dunders (e.g. PEP 562 __getattr__ and __dir__) and the definitions
+        with side effects: decorators, metaclasses, and subclasses of a class registering them (inherited
+        __init_subclass__ or metaclass). Star imports are opaque: with one, the names loaded through it are unknown and
+        no definition is removed.
+        """
+        all_names = self.process_all()
+        star_imports = [ast.unparse(node) for parse_result, _ in self.processed_code
+                        for node in parse_result.external_imports + parse_result.internal_imports
+                        if any(alias.name == '*' for alias in node.names)]
+        definitions = defaultdict(list)  # name -> definitions
+        pending = list(all_names or [])
+        for parse_result, rel_path in self.processed_code:
+            pending.extend(parse_result.references)
+            for definition in parse_result.definitions:
+                definitions[definition.name].append(definition)
+                if definition.side_effects or rel_path == '__main__.py' or is_dunder(definition.name) or \
+                        all_names is None and not definition.name.startswith('_'):
+                    pending.append(definition.name)
+
+        # classes whose subclasses are registered on definition, through an inherited __init_subclass__ or metaclass
+        registering_classes = {name for name, name_definitions in definitions.items()
+                               if any(definition.registers_subclasses for definition in name_definitions)}
+        subclasses = {name for name, name_definitions in definitions.items()
+                      if any(definition.bases for definition in name_definitions)}
+        while True:
+            registered_subclasses = {name for name in subclasses
+                                     if any(base in registering_classes
+                                            for definition in definitions[name] for base in definition.bases)}
+            if registered_subclasses <= registering_classes:
+                break
+            registering_classes |= registered_subclasses
+        pending.extend(registered_subclasses)
+
+        used_names = set()
+        while pending:
+            name = pending.pop()
+            if name not in used_names:
+                used_names.add(name)
+                for definition in definitions.get(name, ()):
+                    pending.extend(definition.references)
+        self.used_names = used_names
+
+        self.removed_definitions = {}
+        if star_imports:
+            info(f"Tree-shaking kept all the definitions because of star imports: {'; '.join(star_imports)}")
+            return
+        for parse_result, rel_path in self.processed_code:
+            removed_definitions = [definition for definition in parse_result.definitions
+                                   if definition.name not in used_names]
+            if removed_definitions:
+                self.removed_definitions[rel_path] = removed_definitions
+        removed_names = sorted(definition.name for removed_definitions in self.removed_definitions.values()
+                               for definition in removed_definitions)
+        if removed_names:
+            info(f"Tree-shaking removed {len(removed_names)} unreachable definitions: {', '.join(removed_names)}")
+
+    def collect_used_names(self) -> set[str]:
+        """Returns the names loaded by the merged segments, and the final '__all__' names."""
+        used_names = set(self.process_all() or [])
+        for parse_result, _ in self.processed_code:
+            used_names.update(parse_result.references)
+            for definition in parse_result.definitions:
+                used_names.update(definition.references)
+        return used_names
+
+    def filter_unused_imports(self, imports: list[Union[ast.Import, ast.ImportFrom]]) \
+            -> list[Union[ast.Import, ast.ImportFrom]]:
+        """Returns the organized imports without the aliases binding names that are not in used_names.
+
+        '__future__' imports, star imports (the names they bind are unknown) and the modules of keep_imports are
+        kept. The removed imports are reported.
+        """
+        kept_imports = []
+        self.removed_imports = []
+        for node in imports:
+            module = node.module if isinstance(node, ast.ImportFrom) else node.names[0].name
+            if module == '__future__' or module in self.keep_imports:
+                kept_imports.append(node)
+                continue
+            aliases = [alias for alias in node.names
+                       if alias.name == '*' or (alias.asname or alias.name.split('.')[0]) in self.used_names]
+            if len(aliases) == len(node.names):
+                kept_imports.append(node)
+                continue
+
+            removed_aliases = [alias for alias in node.names if alias not in aliases]
+            if isinstance(node, ast.ImportFrom):
+                self.removed_imports.append(ast.unparse(ast.ImportFrom(module=node.module, names=removed_aliases,
+                                                                       level=node.level)))
+                if aliases:
+                    kept_imports.append(ast.ImportFrom(module=node.module, names=aliases, level=node.level))
+            else:
+                self.removed_imports.append(ast.unparse(node))
 
-                # ignore internal imports
-                if script_node.is_internal_import(self.module_name):
-                    continue
+        if self.removed_imports:
+            info(f"Removed {len(self.removed_imports)} unused imports: {'; '.join(self.removed_imports)}")
+        return kept_imports
 
-                # ignore external imports without asname
-                if isinstance(script_node.node, (ast.Import, ast.ImportFrom)):
-                    # find which alias
-                    alias = None
-                    for alias in script_node.node.names:
-                        if (alias.asname or alias.name) == name:
-                            break
-
-                    # check asname
-                    if not alias or not alias.asname:
-                        continue
-
-                if name in self.global_context:
-                    other_rel_path, other_script_node = self.global_context[name]
-                    warning(
-                        f"Global alias conflict {name} exists in two files {rel_path} and {other_rel_path}.")
-                    self.global_context_conflicts[name].update((rel_path, other_rel_path))
-                else:
-                    self.global_context[name] = rel_path, script_node
-
-    def process_internal_imports(self, current_path, internal_imports: list[ScriptNode]):
+    def check_global_names(self, parse_result, rel_path):
+        for name in parse_result.global_names:
+            if name in self.global_context:
+                other_rel_path = self.global_context[name]
+                warning(
+                    f"Global alias conflict {name} exists in two files {rel_path} and {other_rel_path}.")
+                self.global_context_conflicts[name].update((rel_path, other_rel_path))
+            else:
+                self.global_context[name] = rel_path
+
+    def process_internal_imports(self, current_path, internal_imports: list[Union[ast.Import, ast.ImportFrom]]):
         imported_names = set()
-        import_paths = set()
+        import_paths = dict()  # ordered set
         for import_node in internal_imports:
-            node_import_paths, node_imported_names = self.process_internal_import(current_path, import_node.node)
-            import_paths.update(node_import_paths)
+            node_import_paths, node_imported_names = self.process_internal_import(current_path, import_node)
+            import_paths.update(dict.fromkeys(node_import_paths))
             if node_imported_names:
                 imported_names.update(node_imported_names)
-        return import_paths, imported_names
+        return list(import_paths), imported_names
 
     def process_internal_import(self, current_path, import_node: ast.AST):
         imported_names = None
         import_paths = list()
-
-        def _find_module_file(_sub_module_parent, _sub_module_name):
-            for path in (
-                    join(_sub_module_parent, _sub_module_name, "__init__.py"),
-                    join(_sub_module_parent, f"{_sub_module_name}.py"),
-            ):
-                if isfile(path):
-                    return path
-            return None
+        if self.module_map is None:
+            self.module_map = self.build_module_map()
 
         if isinstance(import_node, ast.Import):
             for alias in import_node.names:
                 assert ScriptNode.is_local_module(self.module_name, alias.name)
-                sub_module_import_path_parts = alias.name.split('.')
-                sub_module_parent_dir = join(self.module_path, *sub_module_import_path_parts[1:-1])
-                sub_module_file_path = _find_module_file(sub_module_parent_dir, sub_module_import_path_parts[-1])
+                sub_module_file_path = self.module_map.get(alias.name)
                 if sub_module_file_path:
                     import_paths.append(sub_module_file_path)
         elif isinstance(import_node, ast.ImportFrom):
@@ -302,19 +791,17 @@ class PythonModuleMerger:
             assert import_node.level > 0 or ScriptNode.is_local_module(self.module_name, import_node.module)
 
             if import_node.level > 0:  # relative
-                start_path = normpath(join(current_path, '../' * import_node.level))
-                if import_node.module:
-                    sub_module_import_path_parts = import_node.module.split('.')
-                    sub_module_parent_dir = join(start_path, *sub_module_import_path_parts[:-1])
-                    sub_module_file_path = _find_module_file(sub_module_parent_dir, sub_module_import_path_parts[-1])
-                else:  # Handle 'from . import x'
-                    start_path, sub_module_name = dirname(start_path), basename(start_path)
-                    sub_module_file_path = _find_module_file(start_path, sub_module_name)
+                package_parts = [self.module_name] + relpath(dirname(current_path), self.module_path).split(os.sep)
+                package_parts = [part for part in package_parts if part != os.curdir]
+                if import_node.level - 1 < len(package_parts):
+                    sub_module_name = '.'.join(package_parts[:len(package_parts) - import_node.level + 1] +
+                                               ([import_node.module] if import_node.module else []))
+                else:  # beyond the top-level package
+                    sub_module_name = None
             else:  # absolute
-                sub_module_import_path_parts = import_node.module.split('.')
-                sub_module_parent_dir = join(self.module_path, *sub_module_import_path_parts[1:-1])
-                sub_module_file_path = _find_module_file(sub_module_parent_dir, sub_module_import_path_parts[-1])
+                sub_module_name = import_node.module
 
+            sub_module_file_path = self.module_map.get(sub_module_name)
             if sub_module_file_path:
                 import_paths.append(sub_module_file_path)
 
@@ -323,6 +810,20 @@ class PythonModuleMerger:
 
         return import_paths, imported_names
 
+    def build_module_map(self) -> dict[str, str]:
+        """Maps the dotted names of the discovered module files to their paths.
+
+        A package (directory with an __init__.py) takes precedence over a module file with the same name.
+        """
+        module_map = {}
+        for rel_path in self.discover_files():
+            parts = [self.module_name] + rel_path[:-len(".py")].split(os.sep)
+            if parts[-1] == "__init__":
+                module_map['.'.join(parts[:-1])] = join(self.module_path, rel_path)
+            else:
+                module_map.setdefault('.'.join(parts), join(self.module_path, rel_path))
+        return module_map
+
     def organize_to_level_imports(self) -> list[Union[ast.Import, ast.ImportFrom]]:
         imports = {}
         from_imports = {}
@@ -362,11 +863,11 @@ class PythonModuleMerger:
 
         # sort from imports
         for from_import in from_imports.values():
-            from_import.names.sort(key=lambda _alias: _alias.name)
+            from_import.names.sort(key=lambda _alias: (_alias.name, _alias.asname or ''))
 
         # sort imports
         imports_lst: list[ast.Import] = list(imports.values())
-        imports_lst.sort(key=lambda _node: _node.names[0].name)
+        imports_lst.sort(key=lambda _node: (_node.names[0].name, _node.names[0].asname or ''))
         from_imports_lst: list[ast.ImportFrom] = list(from_imports.values())
         from_imports_lst.sort(key=lambda _node: _node.module)
         final_list: list[Union[ast.Import, ast.ImportFrom]] = list()
@@ -376,6 +877,23 @@ class PythonModuleMerger:
 
         return final_list
 
+    @staticmethod
+    def is_lazy_import(node: Union[ast.Import, ast.ImportFrom]) -> bool:
+        """Whether an organized import can be lazy: 'import x' statements of modules outside the standard library.
+
+        'from x import y' statements stay eager, as y may be any object (e.g. a base class used at import time).
+        """
+        return isinstance(node, ast.Import) and node.names[0].name.split('.')[0] not in STDLIB_MODULE_NAMES
+
+    @staticmethod
+    def generate_lazy_import_code(node: ast.Import) -> str:
+        alias = node.names[0]
+        if alias.asname:
+            return f"{alias.asname} = {LAZY_IMPORT_FUNCTION_NAME}({alias.name!r})"
+        if '.' in alias.name:  # import x.y binds x
+            return f"{alias.name.split('.')[0]} = {LAZY_IMPORT_FUNCTION_NAME}({alias.name!r}, top_level=True)"
+        return f"{alias.name} = {LAZY_IMPORT_FUNCTION_NAME}({alias.name!r})"
+
     def generate_all_node(self):
         all_names = self.process_all()
         if all_names:
@@ -428,8 +946,9 @@ class PythonModuleMerger:
         if self.project_website:
             docstring_parts.append(f"Website: {self.project_website}")
 
-        generation_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current time
-        docstring_parts.append(f"Generated On: {generation_time}")
+        generation_time = self.get_generation_time()
+        if generation_time:
+            docstring_parts.append(f"Generated On: {generation_time}")
 
         if self.additional_headers:
             docstring_parts.append("\nAdditional Metadata:")
@@ -440,7 +959,84 @@ class PythonModuleMerger:
 
         return '\n'.join(docstring_parts)
 
+    def get_generation_time(self) -> Optional[str]:
+        """Returns the SOURCE_DATE_EPOCH time if set, else None if reproducible, else the current time."""
+        source_date_epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if source_date_epoch:
+            try:
+                generation_time = datetime.datetime.fromtimestamp(int(source_date_epoch), tz=datetime.timezone.utc)
+                return generation_time.strftime("%Y-%m-%d %H:%M:%S")
+            except (ValueError, OverflowError, OSError):
+                warning(f"Ignoring invalid SOURCE_DATE_EPOCH {source_date_epoch!r}.")
+        if self.reproducible:
+            return None
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current time
+
+    def run_import_profile(self) -> bool:
+        """Profiles the import of the output file, returns False if it fails or exceeds the import time budget."""
+        info(f"Profiling the import of {self.output_file}...")
+        try:
+            self.import_profile = profile_import(self.output_file, self.module_name, env=self._get_run_tests_env())
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            error(f"Import profiling failed: {e}")
+            return False
+
+        total_ms = self.import_profile.total_us / 1000
+        info(f"Import time of {self.module_name}: {total_ms:.2f} ms, top offenders:")
+        for name, us in self.import_profile.top(self.profile_top):
+            info(f"  {us / 1000:>9.2f} ms  {name}")
+        self.import_time_budget_exceeded = self.import_time_budget is not None and total_ms > self.import_time_budget
+        if self.import_time_budget_exceeded:
+            error(f"Import time {total_ms:.2f} ms exceeds the budget of {self.import_time_budget:.2f} ms.")
+            return False
+        return True
+
+    def generate_targets(self) -> list[tuple[str, bytes]]:
+        """Returns the (path, content) of the enabled output targets, built from the output file."""
+        if not self.pyc and not self.zipapp:
+            return []
+        with open(self.output_file, 'rb') as f:
+            source = f.read()
+        targets = []
+        if self.pyc:
+            targets.append((self.pyc_file, compile_pyc(source, basename(self.output_file))))
+        if self.zipapp:
+            targets.append((self.zipapp_file, build_zipapp(source, self.module_name, self.zipapp_interpreter)))
+        return targets
+
+    def write_targets(self):
+        for target_file, content in self.generate_targets():
+            with AtomicWriter(target_file, encoding=None, skip_unchanged=True) as writer:
+                writer.write(content)
+            if target_file == self.zipapp_file and self.zipapp_interpreter:
+                os.chmod(target_file, os.stat(target_file).st_mode | 0o111)
+            if writer.unchanged:
+                info(f"Output unchanged, {target_file} left untouched.")
+            else:
+                success(f"Output target written to {target_file}.")
+
+    def validate_targets(self) -> bool:
+        """Imports the output targets in a fresh interpreter, returns False if one fails."""
+        env = self._get_run_tests_env()
+        targets = ([(self.pyc_file, self.output_dir)] if self.pyc else []) + \
+                  ([(self.zipapp_file, self.zipapp_file)] if self.zipapp else [])  # (target file, import path)
+        targets_ok = True
+        for target_file, path in targets:
+            info(f"Importing {target_file}...")
+            try:
+                validation_error = validate_target(abspath(path), self.module_name, env=env, timeout=self.test_timeout)
+            except subprocess.TimeoutExpired as e:
+                validation_error = str(e)
+            if validation_error:
+                error(f"Importing {target_file} failed:\n{validation_error}")
+                targets_ok = False
+            else:
+                success(f"Imported {target_file} successfully.")
+        return targets_ok
+
     def generate_and_run_tests(self):
+        targets_ok = self.validate_targets()
+
         info(f"Started merging test scripts...")
 
         if self.merge_test_scripts:
@@ -452,29 +1048,71 @@ class PythonModuleMerger:
                 license=self.license,
                 run_test_scripts=False,
                 merge_test_scripts=False,
+                exclude=self.exclude,
+                use_gitignore=self.use_gitignore,
+                reproducible=self.reproducible,
+                lazy_imports=self.lazy_imports,
+                keep_imports=list(self.keep_imports),
             )
             self.test_merger.merge_files()
             test_dir = self.test_merger.output_dir
             test_files = [self.test_merger.output_file]
         else:
             test_dir = self.test_scripts_dirpath
-            test_files = [join(self.test_scripts_dirpath, fn) for fn in os.listdir(self.test_scripts_dirpath) if
-                          fn.endswith('.py') and fn.startswith('test_')]
+            test_files = list(FileDiscovery(self.test_scripts_dirpath, include=['test_*.py'], recursive=False,
+                                            exclude=self.exclude, use_gitignore=self.use_gitignore).iter_paths())
 
         env = self._get_run_tests_env()
-        test_results = [self._run_test_script(test_file, env=env, cwd=test_dir) for test_file in test_files]
-        return all(test_results)
+        start_time = time.perf_counter()
+        jobs = min(self.test_jobs, len(test_files))
+        if jobs > 1:
+            # output captured, and shown in order once all the scripts finished
+            info(f"Running {len(test_files)} test scripts with {jobs} workers...")
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                self.test_results = list(executor.map(
+                    self._run_test_script, test_files, repeat(env), repeat(test_dir), repeat(self.test_timeout),
+                    repeat(True)))
+            for result in self.test_results:
+                info(f"Output of test script {result.file_path}:")
+                sys.stdout.write(result.output)
+                sys.stdout.flush()
+                self._report_test_script(result)
+        else:
+            self.test_results = []
+            for test_file in test_files:
+                info(f"Running test script {test_file}...")
+                self.test_results.append(self._run_test_script(test_file, env, test_dir, self.test_timeout))
+                self._report_test_script(self.test_results[-1])
+
+        failed = [result for result in self.test_results if not result.ok]
+        timed_out = sum(result.timed_out for result in failed)
+        (error if failed else success)(
+            f"Test scripts: {len(self.test_results) - len(failed)} passed, {len(failed)} failed"
+            f"{f' ({timed_out} timed out)' if timed_out else ''} in {time.perf_counter() - start_time:.2f}s.")
+        return not failed and targets_ok
 
     @staticmethod
-    def _run_test_script(filepath, env, cwd):
-        info(f"Running test script {filepath}...")
-        result = subprocess.run([sys.executable, abspath(filepath)], cwd=cwd,
-                                env=env)
-        if result.returncode == 0:
-            success(f"Test script {filepath} finished successfully")
+    def _run_test_script(filepath, env, cwd, timeout: Optional[float] = None, capture=False) -> 'TestScriptResult':
+        """Runs a test script, with its output captured (stderr merged into stdout) if capture is set."""
+        start_time = time.perf_counter()
+        try:
+            process = subprocess.run([sys.executable, abspath(filepath)], cwd=cwd, env=env, timeout=timeout,
+                                     stdout=subprocess.PIPE if capture else None,
+                                     stderr=subprocess.STDOUT if capture else None)
+        except subprocess.TimeoutExpired as e:  # the script was killed
+            output = e.stdout.decode('utf-8', errors='replace') if e.stdout else ''
+            return TestScriptResult(filepath, False, None, time.perf_counter() - start_time, output, timed_out=True)
+        output = process.stdout.decode('utf-8', errors='replace') if capture else ''
+        return TestScriptResult(filepath, process.returncode == 0, process.returncode,
+                                time.perf_counter() - start_time, output)
+
+    def _report_test_script(self, result: 'TestScriptResult'):
+        if result.ok:
+            success(f"Test script {result.file_path} finished successfully in {result.elapsed:.2f}s")
+        elif result.timed_out:
+            error(f"Test script {result.file_path} timed out after {self.test_timeout}s.")
         else:
-            error(f"Test script {filepath} returned errors.")
-        return result.returncode == 0
+            error(f"Test script {result.file_path} returned errors.")
 
     def _get_run_tests_env(self):
         env = os.environ.copy()
@@ -494,6 +1132,91 @@ class PythonModuleMerger:
         return env
 
 
+# top-level modules of the standard library, never lazy imported (None before Python 3.10)
+STDLIB_MODULE_NAMES = getattr(sys, 'stdlib_module_names', None)
+
+LAZY_IMPORT_FUNCTION_NAME = '_monoscript_lazy_import'
+LAZY_IMPORT_FUNCTION_CODE = f'''def {LAZY_IMPORT_FUNCTION_NAME}(name, top_level=False):
+    """Imports a module, and its parent packages, executed on first attribute access (importlib.util.LazyLoader)."""
+    import importlib.util
+    import sys
+    parent_name, _, child_name = name.rpartition('.')
+    if parent_name:
+        {LAZY_IMPORT_FUNCTION_NAME}(parent_name)
+    if name not in sys.modules:
+        # read the parent __path__ without triggering its load
+        path = object.__getattribute__(sys.modules[parent_name], '__dict__').get('__path__') if parent_name else None
+        spec = next(filter(None, (finder.find_spec(name, path) for finder in sys.meta_path
+                                  if hasattr(finder, 'find_spec'))), None)
+        if spec is None:
+            raise ModuleNotFoundError(f"No module named {{name!r}}", name=name)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        if parent_name:
+            setattr(sys.modules[parent_name], child_name, module)
+    return sys.modules[name.split('.')[0]] if top_level else sys.modules[name]
+'''
+
+
+LAZY_SEGMENT_FUNCTION_NAME = '_monoscript_segment'
+LAZY_SEGMENT_RUN_FUNCTION_NAME = '_monoscript_run_segment'
+# The segments are registered with their source and their code object marshalled by the Python version that merged
+# them, compiled from the source by other versions.
+LAZY_SEGMENTS_CODE = f'''# rel_path -> [dependencies, source, state: None, 'running' or 'done', marshalled code]
+_monoscript_segments = {{}}
+_monoscript_lazy_names = {{}}  # name -> rel_path of the segment binding it
+_monoscript_segments_lock = __import__('threading').RLock()
+_monoscript_segments_magic = {importlib.util.MAGIC_NUMBER!r}
+
+
+def {LAZY_SEGMENT_FUNCTION_NAME}(rel_path, dependencies, names, source, code=None):
+    _monoscript_segments[rel_path] = [dependencies, source, None, code]
+    for name in names:
+        _monoscript_lazy_names[name] = rel_path
+
+
+def {LAZY_SEGMENT_RUN_FUNCTION_NAME}(rel_path):
+    """Runs a segment in the module namespace, once, after the segments it depends on (import cycles excepted)."""
+    with _monoscript_segments_lock:
+        segment = _monoscript_segments[rel_path]
+        if segment[2] is not None:
+            return
+        segment[2] = 'running'
+        try:
+            for dependency in segment[0]:
+                if dependency in _monoscript_segments:
+                    {LAZY_SEGMENT_RUN_FUNCTION_NAME}(dependency)
+            filename = 'MODULE_NAME/' + rel_path
+            lines = __import__('io').StringIO(segment[1]).readlines()
+            __import__('linecache').cache[filename] = (len(segment[1]), None, lines, filename)
+            if segment[3] is not None and _monoscript_segments_magic == __import__('importlib.util').util.MAGIC_NUMBER:
+                code = __import__('marshal').loads(__import__('zlib').decompress(__import__('base64').b85decode(
+                    segment[3])))
+            else:
+                code = compile(segment[1], filename, 'exec')
+            exec(code, globals())
+        except BaseException:
+            segment[2] = None
+            raise
+        segment[2] = 'done'
+
+
+def __getattr__(name):
+    rel_path = _monoscript_lazy_names.get(name)
+    if rel_path is not None:
+        {LAZY_SEGMENT_RUN_FUNCTION_NAME}(rel_path)
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_monoscript_lazy_names))
+'''
+
+
 class ImportConflictException(Exception):
 
     def __init__(self, alias_name, existing_pointer, new_pointer):
@@ -514,11 +1237,199 @@ def unparse_node(node):
     return ast.unparse(module)
 
 
+def summarize_python_code(code, module_name, definitions=False) -> 'FileParseResult':
+    """Parses python code into the FileParseResult summary used by the merger, with its definitions and references
+    if definitions is set (see FileParseResult.summarize_definitions)."""
+    parse_result = FileParseResult(code=code)
+    if not code or not code.strip():
+        return parse_result
+
+    parser = ScriptParser(code, statements_only=True)
+    root_node = parser.parse()
+
+    # look for __all__ & imports in top level statements
+    for node in root_node.children:
+        if isinstance(node.node, (ast.Import, ast.ImportFrom)):  # process top-level imports
+            if node.is_internal_import(module_name):
+                parse_result.internal_imports.append(node.node)
+            else:
+                parse_result.external_imports.append(node.node)
+                parse_result.external_imports_spans.append((node.start_offset, node.end_offset))
+        extracted_all_names = node.extract_all_names()
+        if extracted_all_names is not None:
+            parse_result.explicit_all_entries.update(extracted_all_names)
+            parse_result.all_spans.append((node.start_offset, node.end_offset))
+    if definitions:
+        parse_result.summarize_definitions(root_node)
+
+    # remove internal imports
+    for node in root_node.find_nodes(ast.Import, ast.ImportFrom):
+        if node.is_internal_import(module_name):
+            parse_result.internal_imports_spans.append((node.start_offset, node.end_offset))
+            if node.parent is not root_node:
+                parse_result.nested_internal_imports.append(node.node)
+
+    # global names
+    for name, statement in root_node.symbols.module.definitions.items():
+        # ignore _
+        if name == '_':
+            continue
+
+        # ignore internal imports
+        if is_internal_import(module_name, statement):
+            continue
+
+        # ignore external imports without asname
+        if isinstance(statement, (ast.Import, ast.ImportFrom)):
+            # find which alias
+            alias = None
+            for alias in statement.names:
+                if (alias.asname or alias.name.split('.')[0]) == name:
+                    break
+
+            # check asname
+            if not alias or not alias.asname:
+                continue
+
+        parse_result.global_names.append(name)
+
+    return parse_result
+
+
+# decorators known not to register the decorated function or class anywhere
+PURE_DECORATORS = {'dataclass', 'total_ordering', 'lru_cache', 'cache', 'cached_property', 'wraps', 'contextmanager',
+                   'asynccontextmanager', 'singledispatch', 'final', 'runtime_checkable', 'overload', 'unique',
+                   'staticmethod', 'classmethod', 'property'}
+
+
+def referenced_names(node: ast.AST) -> set[str]:
+    """Returns the names loaded anywhere in node, string annotations included (local names are not told apart)."""
+    names = set()
+    annotations = []
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            if not isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+        elif isinstance(child, ast.arg) and child.annotation:
+            annotations.append(child.annotation)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and child.returns:
+            annotations.append(child.returns)
+        elif isinstance(child, ast.AnnAssign):
+            annotations.append(child.annotation)
+
+    for annotation in annotations:
+        for child in ast.walk(annotation):
+            if isinstance(child, ast.Constant) and isinstance(child.value, str):
+                try:
+                    expression = ast.parse(child.value, mode='eval')
+                except SyntaxError:
+                    continue
+                names.update(name.id for name in ast.walk(expression) if isinstance(name, ast.Name))
+    return names
+
+
+def is_dunder(name: str) -> bool:
+    return len(name) > 4 and name.startswith('__') and name.endswith('__')
+
+
+def registers_subclasses(node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]) -> bool:
+    """Whether node is a class whose subclasses may be registered when defined: it defines __init_subclass__ or has
+    a metaclass."""
+    return isinstance(node, ast.ClassDef) and (
+            any(keyword.arg == 'metaclass' for keyword in node.keywords) or
+            any(isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)) and
+                statement.name == '__init_subclass__' for statement in node.body))
+
+
+def has_side_effects(node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]) -> bool:
+    """Whether defining node may have effects beyond binding its name: decorators that may register it, or a
+    metaclass."""
+    for decorator in node.decorator_list:
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        decorator_name = decorator.attr if isinstance(decorator, ast.Attribute) else getattr(decorator, 'id', None)
+        if decorator_name not in PURE_DECORATORS:
+            return True
+    return isinstance(node, ast.ClassDef) and any(keyword.arg == 'metaclass' for keyword in node.keywords)
+
+
+def summarize_python_file(file_path, module_name, definitions=False) -> 'FileParseResult':
+    with open(file_path, "r", encoding="utf-8") as f:
+        return summarize_python_code(f.read(), module_name, definitions=definitions)
+
+
+@dataclass
+class TestScriptResult:
+    file_path: str
+    ok: bool
+    returncode: Optional[int]  # None if timed out
+    elapsed: float  # seconds
+    output: str = ''  # stdout and stderr, if captured
+    timed_out: bool = False
+
+
+@dataclass
+class Definition:
+    """Top-level function or class definition, as seen by tree-shaking."""
+    name: str
+    span: tuple[int, int]  # from the first decorator
+    references: list[str]  # names loaded by the definition
+    side_effects: bool = False
+    bases: list[str] = field(default_factory=list)  # names of the base classes
+    registers_subclasses: bool = False  # see registers_subclasses
+
+
 @dataclass
 class FileParseResult:
-    root_node: Optional[ScriptNode]
-    explicit_all_entries: set[str]
-    all_nodes: list[ScriptNode]
-    external_imports_nodes: list[ScriptNode]
-    internal_imports_nodes: list[ScriptNode]
-    internal_imports_all: list[ScriptNode]
+    """Compact, picklable summary of a parsed file: its code, the spans of the nodes to remove and what the merger
+    needs from its imports, '__all__' and global names."""
+    code: str
+    explicit_all_entries: set[str] = field(default_factory=set)
+    external_imports: list[Union[ast.Import, ast.ImportFrom]] = field(default_factory=list)  # top-level
+    internal_imports: list[Union[ast.Import, ast.ImportFrom]] = field(default_factory=list)  # top-level
+    all_spans: list[tuple[int, int]] = field(default_factory=list)
+    external_imports_spans: list[tuple[int, int]] = field(default_factory=list)
+    internal_imports_spans: list[tuple[int, int]] = field(default_factory=list)  # all levels
+    nested_internal_imports: list[Union[ast.Import, ast.ImportFrom]] = field(default_factory=list)  # not top-level
+    global_names: list[str] = field(default_factory=list)
+    definitions: Optional[list[Definition]] = None  # top-level functions and classes, see summarize_definitions
+    references: Optional[set[str]] = None  # names loaded by the other top-level statements
+
+    def summarize_definitions(self, root_node: Optional[ScriptNode] = None) -> 'FileParseResult':
+        """Fills definitions and references, once, from the parsed root_node or by parsing the code again. Only
+        tree-shaking, unused import removal and lazy segments use them: other merges do not compute them."""
+        if self.definitions is not None:
+            return self
+        self.definitions, self.references = [], set()
+        if not self.code.strip():
+            return self
+
+        root_node = root_node or ScriptParser(self.code, statements_only=True).parse()
+        for node in root_node.children:
+            if isinstance(node.node, (ast.Import, ast.ImportFrom)) or node.extract_all_names() is not None:
+                continue
+            if isinstance(node.node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start_offset = node.start_offset
+                if node.node.decorator_list:  # the statement starts at the first decorator line
+                    start_offset = node.buffer.offset(node.node.decorator_list[0].lineno, 0)
+                self.definitions.append(Definition(node.node.name, (start_offset, node.end_offset),
+                                                   sorted(referenced_names(node.node)), has_side_effects(node.node),
+                                                   [base.id for base in getattr(node.node, 'bases', ())
+                                                    if isinstance(base, ast.Name)],
+                                                   registers_subclasses(node.node)))
+            else:
+                self.references.update(referenced_names(node.node))
+        return self
+
+    def get_code(self, remove_external_imports=True, removed_spans=()) -> str:
+        """Returns the code without '__all__' assignments, internal imports, top-level external imports and
+        removed_spans."""
+        code_lines = split_lines(self.code)
+        if not code_lines:
+            return ''
+
+        cuts = self.internal_imports_spans + self.all_spans + list(removed_spans)
+        if remove_external_imports:
+            cuts += self.external_imports_spans
+        buffer = SourceBuffer(code_lines)
+        return buffer.extract(0, buffer.offset(len(code_lines), len(code_lines[-1]), byte_col=False), sorted(cuts))
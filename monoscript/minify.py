@@ -0,0 +1,207 @@
+import ast
+import io
+import time
+import tokenize
+from dataclasses import dataclass
+from typing import Optional
+from .parser import SourceBuffer, split_lines
+
+# minify levels, each one strips what the previous ones do
+MINIFY_LEVELS = {
+    0: 'disabled',
+    1: 'docstrings, comments, blank lines and segment markers',
+    2: 'function, argument and variable annotations (class body annotations and the annotations of decorated '
+       'functions are kept)',
+    3: 're-emitted with ast.unparse',
+}
+
+BODY_NODE_TYPES = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def get_docstring_node(node: ast.AST) -> Optional[ast.Expr]:
+    """Returns the docstring statement of a module, function or class node, if any."""
+    if isinstance(node, BODY_NODE_TYPES) and node.body and isinstance(node.body[0], ast.Expr) \
+            and isinstance(node.body[0].value, ast.Constant) and isinstance(node.body[0].value.value, str):
+        return node.body[0]
+    return None
+
+
+def docstring_spans(tree: ast.Module, buffer: SourceBuffer) -> list[tuple[int, int]]:
+    """Returns the spans of the docstrings. A docstring alone in its body is emptied rather than removed."""
+    spans = []
+    for node in ast.walk(tree):
+        docstring = get_docstring_node(node)
+        if not docstring:
+            continue
+        start = buffer.offset(docstring.lineno, docstring.col_offset)
+        end = buffer.offset(docstring.end_lineno, docstring.end_col_offset)
+        if len(node.body) > 1:
+            spans.append((start, end))
+            continue
+        first_line = buffer.lines[docstring.lineno - 1]
+        literal = first_line[start - buffer.line_offsets[docstring.lineno - 1]:]
+        prefix_length = len(literal) - len(literal.lstrip('rRuUbBfF'))
+        quote_length = 3 if literal[prefix_length:prefix_length + 3] in ('"""', "'''") else 1
+        if end - quote_length > start + prefix_length + quote_length:
+            spans.append((start + prefix_length + quote_length, end - quote_length))
+    return spans
+
+
+def iter_annotated_args(arguments: ast.arguments):
+    """Yields the annotated arguments of a function signature."""
+    for arg in arguments.posonlyargs + arguments.args + [arguments.vararg] + arguments.kwonlyargs + [arguments.kwarg]:
+        if arg and arg.annotation:
+            yield arg
+
+
+def annotation_spans(tree: ast.Module, buffer: SourceBuffer, code: str) -> list[tuple[int, int]]:
+    """Returns the spans of the argument and return annotations of undecorated functions (decorators such as
+    functools.singledispatch register read them), and of the annotations of assignments with a value outside of class
+    bodies (dataclass and NamedTuple fields are declared by them)."""
+    class_body_statements = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            class_body_statements.update(id(statement) for statement in node.body)
+
+    spans = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.decorator_list:
+            for arg in iter_annotated_args(node.args):
+                spans.append((buffer.offset(arg.lineno, arg.col_offset) + len(arg.arg),
+                              buffer.offset(arg.annotation.end_lineno, arg.annotation.end_col_offset)))
+            if node.returns:
+                returns_start = buffer.offset(node.returns.lineno, node.returns.col_offset)
+                arrow_start = code.rfind('->', 0, returns_start)
+                while code[arrow_start - 1] in ' \t':  # 'def f(a) -> int:' becomes 'def f(a):'
+                    arrow_start -= 1
+                spans.append((arrow_start, buffer.offset(node.returns.end_lineno, node.returns.end_col_offset)))
+        elif isinstance(node, ast.AnnAssign) and node.value and id(node) not in class_body_statements:
+            spans.append((buffer.offset(node.target.end_lineno, node.target.end_col_offset),
+                          buffer.offset(node.annotation.end_lineno, node.annotation.end_col_offset)))
+    return spans
+
+
+def comment_spans(code: str, buffer: SourceBuffer) -> list[tuple[int, int]]:
+    """Returns the spans of the comments, with the whitespace preceding them on their line."""
+    spans = []
+    last_end = None  # (row, col) of the last token end
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.COMMENT:
+            row, col = token.start
+            if last_end and last_end[0] == row and last_end[1] <= col:
+                col = last_end[1]
+            spans.append((buffer.offset(row, col, byte_col=False),
+                          buffer.offset(token.end[0], token.end[1], byte_col=False)))
+        elif token.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+            last_end = token.end
+    return spans
+
+
+def strip_blank_lines(code: str) -> str:
+    """Returns code without its blank lines, those inside multi-line strings excepted."""
+    string_lines = set()  # 1-based lines continuing a token started on a previous line
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.end[0] > token.start[0]:
+            string_lines.update(range(token.start[0] + 1, token.end[0] + 1))
+    return '\n'.join(line for ix, line in enumerate(split_lines(code), start=1)
+                     if line.strip() or ix in string_lines)
+
+
+class AnnotationRemover(ast.NodeTransformer):
+    """Removes docstrings and the annotations removed by the level 2, see annotation_spans."""
+
+    def visit_Module(self, node):
+        return self._remove_docstring(self.generic_visit(node))
+
+    def visit_FunctionDef(self, node):
+        if node.decorator_list:  # the decorators may read the annotations, see annotation_spans
+            node.decorator_list = [self.visit(decorator) for decorator in node.decorator_list]
+            node.body = [self.visit(statement) for statement in node.body]
+            return self._remove_docstring(node)
+        node.returns = None
+        return self._remove_docstring(self.generic_visit(node))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        node.decorator_list = [self.visit(decorator) for decorator in node.decorator_list]
+        node.body = [statement if isinstance(statement, ast.AnnAssign) else self.visit(statement)
+                     for statement in node.body]
+        return self._remove_docstring(node)
+
+    def visit_arg(self, node):
+        node.annotation = None
+        return node
+
+    def visit_AnnAssign(self, node):
+        if node.value is None:
+            return node
+        return ast.copy_location(ast.Assign(targets=[node.target], value=node.value), node)
+
+    @staticmethod
+    def _remove_docstring(node):
+        if get_docstring_node(node):
+            node.body = node.body[1:] or [ast.copy_location(ast.Pass(), node.body[0])]
+        return node
+
+
+def _minify_code(code: str, level: int) -> str:
+    tree = ast.parse(code)
+    if level >= 3:
+        return strip_blank_lines(ast.unparse(ast.fix_missing_locations(AnnotationRemover().visit(tree))))
+
+    code_lines = split_lines(code)
+    buffer = SourceBuffer(code_lines)
+    cuts = docstring_spans(tree, buffer) + comment_spans(code, buffer)
+    if level >= 2:
+        cuts += annotation_spans(tree, buffer, '\n'.join(code_lines))
+    minified_code = strip_blank_lines(
+        buffer.extract(0, buffer.offset(len(code_lines), len(code_lines[-1]), byte_col=False), sorted(cuts)))
+    ast.parse(minified_code)  # cuts of unusual syntax, e.g. parenthesized annotations, may break the code
+    return minified_code
+
+
+def minify_code(code: str, level: int) -> tuple[str, int]:
+    """Returns code minified at level, or at the highest lower level that keeps it valid, and that level.
+
+    Raises SyntaxError if code itself is not valid.
+    """
+    if not code.strip() or level <= 0:
+        return code, 0
+    ast.parse(code)
+    for applied_level in range(level, 0, -1):
+        try:
+            return _minify_code(code, applied_level), applied_level
+        except SyntaxError:
+            continue
+    return code, 0
+
+
+@dataclass
+class MinifyReport:
+    """Size and compile time of the merged code segments, before and after minification."""
+    original_size: int = 0  # utf-8 bytes
+    minified_size: int = 0
+    original_compile_ns: int = 0
+    minified_compile_ns: int = 0
+
+    def add(self, original_code: str, minified_code: str):
+        self.original_size += len(original_code.encode('utf-8'))
+        self.minified_size += len(minified_code.encode('utf-8'))
+        self.original_compile_ns += self._compile_time(original_code)
+        self.minified_compile_ns += self._compile_time(minified_code)
+
+    @staticmethod
+    def _compile_time(code: str) -> int:
+        start_time = time.perf_counter_ns()
+        compile(code, '<minify>', 'exec')
+        return time.perf_counter_ns() - start_time
+
+    def __str__(self):
+        def saved(original, minified):
+            return f"{100 * (original - minified) / original:.1f}% saved" if original else "nothing saved"
+
+        return f"Minified {self.original_size} -> {self.minified_size} bytes " \
+               f"({saved(self.original_size, self.minified_size)}), compile time " \
+               f"{self.original_compile_ns / 1e6:.2f} -> {self.minified_compile_ns / 1e6:.2f} ms " \
+               f"({saved(self.original_compile_ns, self.minified_compile_ns)})."
@@ -1,159 +1,417 @@
 import ast
-import os
+import heapq
+import re
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
 from typing import List, Optional, Generator
+from .symbols import SymbolTable
+
+# statement-level nodes, the only ones wrapped in statements only mode
+STATEMENT_NODE_TYPES = (ast.mod, ast.stmt, ast.excepthandler) + \
+    ((ast.match_case,) if hasattr(ast, 'match_case') else ())
+
+SCOPE_NODE_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+LINE_BREAK_RE = re.compile(r'\r\n|\r|\n')
+
+
+def split_lines(code: str) -> List[str]:
+    """Splits code on the line breaks the tokenizer counts. Unlike str.splitlines(), form feeds and the other unicode
+    line separators do not break lines, so the lines match the ast line numbers."""
+    lines = LINE_BREAK_RE.split(code)
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def iter_child_nodes(node: ast.AST, child_type=ast.AST) -> Generator[ast.AST, None, None]:
+    """Yields the direct AST children of node of the given type, in fields order."""
+    for field_name, value in ast.iter_fields(node):
+        if isinstance(value, list):  # List of child nodes
+            for item in value:
+                if isinstance(item, child_type):
+                    yield item
+        elif isinstance(value, child_type):  # Single child node
+            yield value
+
+
+class SourceBuffer:
+    """Edit buffer over the lines of a source, addressed by absolute character offsets.
+
+    Offsets are counted as if the lines were joined with a single newline character. Removed ranges are
+    passed as sorted lists of (start_offset, end_offset) tuples and applied in one linear pass.
+    """
+
+    def __init__(self, code_lines: List[str]):
+        self.lines = code_lines
+        self.line_offsets = list()
+        offset = 0
+        for line in code_lines:
+            self.line_offsets.append(offset)
+            offset += len(line) + 1
+
+    def offset(self, line: int, col: int, byte_col=True) -> int:
+        """Converts a 1-based line and a column (utf-8 bytes offset as in ast nodes) to an absolute offset."""
+        text = self.lines[line - 1]
+        if byte_col and not text.isascii():
+            col = len(text.encode('utf-8')[:col].decode('utf-8', errors='ignore'))
+        return self.line_offsets[line - 1] + col
+
+    def line_index(self, offset: int) -> int:
+        return bisect_right(self.line_offsets, offset) - 1
+
+    def extract(self, start: int, end: int, cuts=()) -> str:
+        """Extracts the code between start and end offsets, skipping the (sorted) removed ranges in cuts.
+
+        Lines touched by a cut are dropped if nothing but whitespace or a comment is left of them; blank lines
+        and untouched lines are kept as is.
+        """
+        lines, line_offsets = self.lines, self.line_offsets
+        clipped_lines = list()
+        ix, cuts_count = 0, len(cuts)
+
+        for line_ix in range(self.line_index(start), self.line_index(end) + 1):
+            line = lines[line_ix]
+            line_start = line_offsets[line_ix]
+            line_end = line_start + len(line)
+            low, high = max(start, line_start), min(end, line_end)
+            is_cut = low != line_start or high != line_end
+
+            pieces = list()
+            pos = low
+            while ix < cuts_count and cuts[ix][0] < high:
+                cut_start, cut_end = cuts[ix]
+                if cut_end > pos:
+                    is_cut = True
+                    if cut_start > pos:
+                        pieces.append(line[pos - line_start:cut_start - line_start])
+                    pos = cut_end
+                if cut_end > high:  # cut continues on next lines
+                    break
+                ix += 1
+
+            if not is_cut or not line.strip():
+                clipped_lines.append(line)
+                continue
+
+            if pos < high:
+                pieces.append(line[pos - line_start:high - line_start])
+            line = ''.join(pieces)
+            line_stripped = line.strip()
+            if line_stripped and not line_stripped.startswith('#'):
+                clipped_lines.append(line)
+
+        return '\n'.join(clipped_lines)
+
+
+class RemovalRegistry:
+    """Sorted registry of the removed ranges of a source, shared by all the nodes of a tree."""
+
+    def __init__(self):
+        self.ranges: List[tuple[int, int]] = list()  # sorted (start_offset, end_offset)
+        self.nodes: dict[tuple[int, int], list['ScriptNode']] = dict()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def add(self, script_node: 'ScriptNode'):
+        span = script_node.start_offset, script_node.end_offset
+        if span not in self.nodes:
+            insort(self.ranges, span)
+            self.nodes[span] = list()
+        self.nodes[span].append(script_node)
+
+    def add_many(self, script_nodes: List['ScriptNode']):
+        new_ranges = list()
+        for script_node in script_nodes:
+            span = script_node.start_offset, script_node.end_offset
+            if span not in self.nodes:
+                new_ranges.append(span)
+                self.nodes[span] = list()
+            self.nodes[span].append(script_node)
+        if new_ranges:
+            self.ranges.extend(new_ranges)
+            self.ranges.sort()
+
+    def query(self, script_node: 'ScriptNode') -> List[tuple[int, int]]:
+        """Returns the sorted removed ranges inside the given node, the node itself and its ancestors excluded."""
+        start, end = script_node.start_offset, script_node.end_offset
+        ranges = list()
+        for ix in range(bisect_left(self.ranges, (start, start)), len(self.ranges)):
+            span = self.ranges[ix]
+            if span[0] > end:
+                break
+            if span[1] > end:
+                continue
+            if span == (start, end) and all(script_node.is_descendant_of(removed_node)
+                                            for removed_node in self.nodes[span]):
+                continue
+            ranges.append(span)
+        return ranges
+
+
+class NodeIndex:
+    """Index of the AST nodes of a tree by type, built once, on the first lookup: parsing and walking the top-level
+    nodes do not pay for it.
+
+    Indexed nodes are resolved to their ScriptNode on demand, materializing only their ancestors. In statements
+    only mode, only statement-level nodes are indexed.
+    """
+
+    def __init__(self, tree: ast.AST, statements_only=False):
+        self.tree = tree
+        self.statements_only = statements_only
+        self.by_type: Optional[dict[type, list[tuple[int, ast.AST]]]] = None  # (pre-order position, node)
+        self.parents: Optional[dict[int, ast.AST]] = None
+        self.wrappers: dict[int, ScriptNode] = dict()
+        self.removed: set[int] = set()
+
+    def build(self):
+        if self.by_type is not None:
+            return
+        self.by_type, self.parents = defaultdict(list), dict()
+        child_type = STATEMENT_NODE_TYPES if self.statements_only else ast.AST
+        position = 0
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            self.by_type[type(node)].append((position, node))
+            position += 1
+            children = list(iter_child_nodes(node, child_type))
+            for child in children:
+                self.parents[id(child)] = node
+            stack.extend(reversed(children))
+
+    def find(self, *node_types) -> Generator[ast.AST, None, None]:
+        """Yields the indexed AST nodes of the given types (or subtypes), in pre-order."""
+        self.build()
+        lists = [nodes for index_type, nodes in self.by_type.items() if issubclass(index_type, node_types)]
+        for position, node in heapq.merge(*lists, key=lambda item: item[0]):
+            yield node
+
+    def get(self, node: ast.AST) -> Optional['ScriptNode']:
+        """Returns the ScriptNode of an indexed AST node, or None if it was removed from the tree."""
+        self.build()
+        path = list()
+        ancestor = node
+        while ancestor is not None:
+            if id(ancestor) in self.removed:
+                return None
+            path.append(ancestor)
+            ancestor = self.parents.get(id(ancestor))
+
+        script_node = None
+        for ancestor in reversed(path):
+            script_node = self.wrappers.get(id(ancestor))
+            if script_node is None:
+                return None
+            if ancestor is not node:
+                script_node.children  # materialize the next level
+        return script_node
 
 
 class ScriptNode:
+    __slots__ = ('node', 'parent', 'root', 'buffer', 'removals', 'index', 'statements_only', '_children',
+                 '_context', '_symbols', 'start_offset', 'end_offset')
+
     def __init__(self, node: ast.AST, children: Optional[List['ScriptNode']] = None,
-                 parent: 'ScriptNode' = None, code_lines=None, root: 'ScriptNode' = None):
+                 parent: 'ScriptNode' = None, buffer: SourceBuffer = None, root: 'ScriptNode' = None,
+                 statements_only=False, index: NodeIndex = None):
         self.parent: Optional[ScriptNode] = parent
-        self.code_lines = code_lines
+        self.buffer = buffer
         self.node: ast.AST = node  # The AST node
-        self.removed_parts = list()
+        self.statements_only = statements_only  # wrap only statement-level children
 
         # root and coords
         if root:
             self.root = root
-            self.start_line = getattr(self.node, 'lineno', None)
-            self.start_col = getattr(self.node, 'col_offset', None)
-            self.end_line = getattr(self.node, 'end_lineno', None)
-            self.end_col = getattr(self.node, 'end_col_offset', None)
+            self.removals = root.removals
+            self.index = root.index
         else:
             self.root = self
-            self.start_line = 1
-            self.start_col = 0
-            self.end_line = len(self.code_lines)
-            self.end_col = len(self.code_lines[-1])
-
-        # children
-        self.children = children if children is not None else []  # Parsed children nodes
-        for child in self.children:
+            self.removals = RemovalRegistry()
+            self.index = index if index is not None else NodeIndex(node, statements_only=statements_only)
+            self.index.wrappers[id(node)] = self
+
+        start_line, start_col, end_line, end_col = self.start_line, self.start_col, self.end_line, self.end_col
+        if all(attrib is not None for attrib in (start_line, end_line, start_col, end_col)):
+            self.start_offset = self.buffer.offset(start_line, start_col, byte_col=root is not None)
+            self.end_offset = self.buffer.offset(end_line, end_col, byte_col=root is not None)
+        else:
+            self.start_offset = self.end_offset = None
+
+        # children, materialized on first access if not given
+        self._children: Optional[List[ScriptNode]] = None
+        if children is not None:
+            self.children = children
+
+        # context & symbol table (root only), built on first access
+        self._context: Optional[dict[str, ScriptNode]] = None
+        self._symbols: Optional[SymbolTable] = None
+
+    @property
+    def children(self) -> List['ScriptNode']:
+        if self._children is None:
+            self._children = [ScriptNode.parse_node(child_node, self.buffer, parent=self,
+                                                    statements_only=self.statements_only)
+                              for child_node in self.iter_child_nodes()]
+            if self.index is not None:
+                for child in self._children:
+                    self.index.wrappers[id(child.node)] = child
+        return self._children
+
+    @children.setter
+    def children(self, children: List['ScriptNode']):
+        self._children = children
+        for child in children:
             child.parent = self
 
-        # context
-        if self.parent is None or isinstance(self.node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-            self.context = dict()
-        else:
-            self.context = self.parent.context
-
-        self._extract_context_names()
-
-    def _extract_context_names(self):
-        def _process_assign_targets(_targets):
-            for _target in _targets:
-                if isinstance(_target, ast.Name):
-                    self.context[_target.id] = self
-                elif isinstance(_target, ast.Tuple):
-                    _process_assign_targets(_target.elts)
-
-        if isinstance(self.node, (ast.Import, ast.ImportFrom)):
-            for alias in self.node.names:
-                self.context[alias.asname or alias.name] = self
-        elif isinstance(self.node, ast.Assign):
-            _process_assign_targets(self.node.targets)
-        elif isinstance(self.node, (ast.AnnAssign, ast.For)):
-            _process_assign_targets([self.node.target])
-        elif isinstance(self.node, ast.withitem):
-            if self.node.optional_vars:
-                _process_assign_targets([self.node.optional_vars])
-        elif isinstance(self.node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-            if self.parent:
-                self.parent.context[self.node.name] = self
-            else:
-                self.context[self.node.name] = self
-            # TODO: function & async function parameter names
-        elif isinstance(self.node, (ast.Global, ast.Nonlocal)):
-            for name in self.node.names:
-                self.context[name] = self
+    def iter_child_nodes(self) -> Generator[ast.AST, None, None]:
+        """Yields the AST child nodes wrapped as children (only statement-level nodes in statements only mode)."""
+        return iter_child_nodes(self.node, STATEMENT_NODE_TYPES if self.statements_only else ast.AST)
+
+    def build(self) -> 'ScriptNode':
+        """Materializes the whole subtree, using an explicit stack instead of recursion."""
+        stack = [self]
+        while stack:
+            stack.extend(stack.pop().children)
+        return self
+
+    @property
+    def symbols(self) -> SymbolTable:
+        """Symbol table of the whole tree, built in one pass on first access."""
+        root = self.root
+        if root._symbols is None:
+            root._symbols = SymbolTable.build(root.node)
+        return root._symbols
+
+    @property
+    def context(self) -> dict[str, 'ScriptNode']:
+        """Names bound in the scope (module, function or class) of this node, mapped to their statements."""
+        scope_node = self
+        while scope_node.parent is not None and not isinstance(scope_node.node, SCOPE_NODE_TYPES):
+            scope_node = scope_node.parent
+        if scope_node._context is None:
+            scope_node._context = dict()
+            for name, statement in self.symbols.scope_of(scope_node.node).definitions.items():
+                script_node = self.index.get(statement)
+                if script_node is not None:
+                    scope_node._context[name] = script_node
+        return scope_node._context
+
+    @property
+    def start_line(self) -> Optional[int]:
+        return getattr(self.node, 'lineno', None) if self.root is not self else 1
+
+    @property
+    def start_col(self) -> Optional[int]:
+        return getattr(self.node, 'col_offset', None) if self.root is not self else 0
+
+    @property
+    def end_line(self) -> Optional[int]:
+        return getattr(self.node, 'end_lineno', None) if self.root is not self else len(self.code_lines)
+
+    @property
+    def end_col(self) -> Optional[int]:
+        return getattr(self.node, 'end_col_offset', None) if self.root is not self else len(self.code_lines[-1])
 
     def __repr__(self):
         return f"ScriptNode(type={type(self.node).__name__}, code={repr(self.get_code())}, children={len(self.children)})"
 
+    @property
+    def code_lines(self) -> List[str]:
+        return self.buffer.lines
+
+    @property
+    def removed_parts(self) -> List[tuple[int, int]]:
+        """Sorted (start_offset, end_offset) ranges of the removed descendants, derived from the root registry."""
+        if self.start_offset is None or not self.removals:
+            return []
+        return self.removals.query(self)
+
+    def is_descendant_of(self, script_node: 'ScriptNode') -> bool:
+        """Checks if script_node is this node or one of its ancestors."""
+        node = self
+        while node is not None:
+            if node is script_node:
+                return True
+            node = node.parent
+        return False
+
     def get_code(self) -> Optional[str]:
         """Extracts the code corresponding to the given node."""
-
-        # start_line, start_col, end_line, end_col = None, None, None, None
-        if all(attrib is not None for attrib in (self.start_line, self.end_line, self.start_col, self.end_col)):
-            if self.root == self:  # root element
-                lines = list(self.code_lines)
-            else:
-                lines = self.code_lines[self.start_line - 1:self.end_line]
-
-            # generate cuts
-            lines_cuts = defaultdict(list)
-            # start and end col
-            if self.end_col != len(lines[-1]):
-                lines_cuts[self.end_line - self.start_line].append((self.end_col, len(lines[-1])))
-
-            if self.start_col != 0:
-                lines_cuts[0].append((0, self.start_col))
-
-            # remove parts cuts
-            for start_line, start_col, end_line, end_col in self.removed_parts:
-                if start_line == end_line:
-                    lines_cuts[start_line - self.start_line].append((start_col, end_col))
-                else:
-
-                    # start line
-                    lines_cuts[start_line - self.start_line].append((start_col, len(lines[start_line - 1])))
-                    # end line
-                    lines_cuts[end_line - self.start_line].append((0, end_col))
-                    # middle lines
-                    for line_ix in range(start_line + 1, end_line):
-                        lines_cuts[line_ix - self.start_line].append((0, len(lines[line_ix - 1])))
-            # print(lines_cuts)
-
-            clipped_lines = list()
-            for ix in range(len(lines)):
-                # print(ix, not lines[ix].strip() or not lines_cuts[ix])
-                if not lines[ix].strip() or not lines_cuts[ix]:
-                    # print(lines[ix], lines_cuts[ix], merge_cuts(lines_cuts[ix]))
-
-                    clipped_lines.append(lines[ix])
-                else:
-                    line = apply_cuts(lines[ix], cuts=merge_cuts(lines_cuts[ix]))
-                    # print(lines[ix], lines_cuts[ix], merge_cuts(lines_cuts[ix]), repr(line))
-                    line_stripped = line.strip()
-                    if line_stripped and not line_stripped.startswith('#'):
-                        clipped_lines.append(line)
-
-            return '\n'.join(clipped_lines)
+        if self.start_offset is not None:
+            return self.buffer.extract(self.start_offset, self.end_offset, self.removed_parts)
 
     def remove_child(self, child: 'ScriptNode'):
-        # remove from children
-        self.children.remove(child)
-
-        # find and remove from node
-        attrib = self.find_child_node(child.node)
-        attrib.remove(child.node)  # must be list to remove
-
-        # find and remove from code
-        self.remove_child_parts(child)
+        if child.parent is not self:
+            raise ValueError(f"{child} is not a child of {self}")
+        self.remove_many([child])
+
+    def remove_many(self, script_nodes):
+        """Removes descendant nodes from their parents children, AST nodes and code, in one pass per parent.
+
+        Raises ValueError, before removing anything, for nodes that are not strict descendants of this node, and for
+        nodes held in a single node field (e.g. an if test), which cannot be removed from the AST.
+        """
+        removed_nodes = list()
+        parents = dict()  # id(parent) -> (parent, ids of the AST nodes to remove)
+        for script_node in script_nodes:
+            parent = script_node.parent
+            if script_node is self or not script_node.is_descendant_of(self):
+                raise ValueError(f"{script_node} is not a descendant of {self}")
+            if id(parent) not in parents:
+                parents[id(parent)] = parent, set()
+            node_ids = parents[id(parent)][1]
+            if id(script_node.node) not in node_ids:
+                node_ids.add(id(script_node.node))
+                removed_nodes.append(script_node)
+
+        for parent, node_ids in parents.values():
+            list_item_ids = {id(item) for _, value in ast.iter_fields(parent.node) if isinstance(value, list)
+                             for item in value}
+            if not node_ids <= list_item_ids:
+                raise ValueError(f"Only the nodes of list fields (e.g. bodies) can be removed from {parent}")
+
+        for parent, node_ids in parents.values():
+            # remove from children
+            if parent._children is not None:
+                parent._children = [child for child in parent._children if id(child.node) not in node_ids]
+
+            # remove from node
+            for field_name, value in ast.iter_fields(parent.node):
+                if isinstance(value, list):
+                    kept_items = [item for item in value if id(item) not in node_ids]
+                    if len(kept_items) != len(value):
+                        value[:] = kept_items
+
+        # remove from code
+        self.removals.add_many(removed_nodes)
+        if self.index is not None:
+            self.index.removed.update(id(script_node.node) for script_node in removed_nodes)
 
     def remove_child_parts(self, child):
-        self.removed_parts.append((child.start_line, child.start_col, child.end_line, child.end_col))
-        if self.parent:
-            self.parent.remove_child_parts(child)
+        self.removals.add(child)
+        if self.index is not None:
+            self.index.removed.add(id(child.node))
 
     def find_child_node(self, child_node):
         for field_name, value in ast.iter_fields(self.node):
-            if child_node == value or isinstance(value, list) and child_node in value:  # List of child nodes
+            if child_node is value or isinstance(value, list) and any(item is child_node for item in value):
                 return value
 
     def find_node_in_children(self, node):
         for child in self.children:
-            if child.node == node:
+            if child.node is node:
                 return child
 
+    def wrap(self, node: ast.AST) -> 'ScriptNode':
+        """Wraps a descendant AST node on demand (e.g. an expression in statements only mode)."""
+        return ScriptNode.parse_node(node, self.buffer, parent=self)
+
     def is_internal_import(self, module_name):
         """Checks if an import is internal (e.g., 'from mymodule.utils import x' or 'from .utils import x')."""
-        if isinstance(self.node, ast.Import):
-            # TODO: Fix any by extracting imports or adding a warning if not all
-            return any(self.is_local_module(module_name, alias.name) for alias in self.node.names)
-        elif isinstance(self.node, ast.ImportFrom):
-            return self.node.level > 0 or self.is_local_module(module_name, self.node.module)
-        return False
+        return is_internal_import(module_name, self.node)
 
     @staticmethod
     def is_local_module(module_name, module_path):
@@ -182,59 +440,65 @@ class ScriptNode:
         return all_names
 
     @staticmethod
-    def parse_node(node, code_lines, parent: 'ScriptNode' = None) -> 'ScriptNode':
-        # Extract the source substring for this node
-
+    def parse_node(node, buffer: SourceBuffer, parent: 'ScriptNode' = None, statements_only=False,
+                   index: NodeIndex = None) -> 'ScriptNode':
+        """Wraps an AST node, its children are wrapped lazily on first access."""
         root = parent.root if parent else None
-
-        # Create a ScriptNode for this AST node
-        script_node = ScriptNode(node=node, children=[], parent=parent, root=root,
-                                 code_lines=code_lines)
-
-        # Extract children nodes
-        children = []
-        for field_name, value in ast.iter_fields(node):
-            if isinstance(value, list):  # List of child nodes
-                for item in value:
-                    if isinstance(item, ast.AST):
-                        children.append(ScriptNode.parse_node(item, code_lines, parent=script_node))
-            elif isinstance(value, ast.AST):  # Single child node
-                children.append(ScriptNode.parse_node(value, code_lines, parent=script_node))
-        script_node.children = children
-
-        return script_node
-
-    def walk(self) -> Generator['ScriptNode', None, None]:
-        for child in self.children:
-            yield from child.walk()
-        yield self
+        return ScriptNode(node=node, parent=parent, root=root, buffer=buffer, statements_only=statements_only,
+                          index=index)
+
+    def walk(self, *node_types) -> Generator['ScriptNode', None, None]:
+        """Yields the subtree nodes in post-order (children first), optionally only those of the given AST types."""
+        stack = [(self, False)]
+        while stack:
+            script_node, expanded = stack.pop()
+            if expanded or not script_node.children:
+                if not node_types or isinstance(script_node.node, node_types):
+                    yield script_node
+            else:
+                stack.append((script_node, True))
+                stack.extend((child, False) for child in reversed(script_node.children))
+
+    def find_nodes(self, *node_types) -> List['ScriptNode']:
+        """Finds the subtree nodes of the given AST types, in pre-order, using the root index."""
+        script_nodes = list()
+        for node in self.index.find(*node_types):
+            script_node = self.index.get(node)
+            if script_node is not None and (self.root is self or script_node.is_descendant_of(self)):
+                script_nodes.append(script_node)
+        return script_nodes
 
     def remove(self):
         self.parent.remove_child(self)
 
 
 class ScriptParser:
-    def __init__(self, code):
+    def __init__(self, code, statements_only=False):
         self.code = code
         self.code_lines = None
+        self.buffer: Optional[SourceBuffer] = None
+        self.statements_only = statements_only  # expressions are wrapped on demand with ScriptNode.wrap
 
     def parse(self) -> ScriptNode:
-        self.code_lines = self.code.splitlines()
+        self.code_lines = split_lines(self.code)
+        self.buffer = SourceBuffer(self.code_lines)
 
         # Parse the code into an AST
         tree = ast.parse(self.code)
 
         # Process the top-level nodes
-        return ScriptNode.parse_node(tree, self.code_lines)
+        index = NodeIndex(tree, statements_only=self.statements_only)
+        return ScriptNode.parse_node(tree, self.buffer, statements_only=self.statements_only, index=index)
 
 
-# def is_internal_import(module_name, node):
-#     """Checks if an import is internal (e.g., 'from mymodule.utils import x' or 'from .utils import x')."""
-#     if isinstance(node, ast.Import):
-#         return any(alias.name.startswith(module_name + ".") for alias in node.names)
-#     elif isinstance(node, ast.ImportFrom):
-#         return node.module and (node.module.startswith(module_name + '.') or node.level > 0)
-#     return False
+def is_internal_import(module_name, node):
+    """Checks if an import is internal (e.g., 'from mymodule.utils import x' or 'from .utils import x')."""
+    if isinstance(node, ast.Import):
+        # TODO: Fix any by extracting imports or adding a warning if not all
+        return any(ScriptNode.is_local_module(module_name, alias.name) for alias in node.names)
+    elif isinstance(node, ast.ImportFrom):
+        return node.level > 0 or ScriptNode.is_local_module(module_name, node.module)
+    return False
 
 
 # def extract_explicit_all(node):
@@ -246,53 +510,3 @@ class ScriptParser:
 #                 return [elt.s for elt in node.value.elts if isinstance(elt, ast.Str)]
 #     return []
 
-
-def merge_cuts(cuts):
-    """Merges overlapping or adjacent cut definitions.
-
-    Args:
-        cuts: A list of 2-tuples representing (start_index, end_index) of cuts.
-
-    Returns:
-        A new list of 2-tuples with merged cuts.
-    """
-
-    if not cuts:
-        return []
-
-    cuts.sort()  # Sort by start index
-    merged_cuts = [cuts[0]]
-
-    for start, end in cuts[1:]:
-        last_start, last_end = merged_cuts[-1]
-        if start <= last_end:  # Overlapping or adjacent
-            merged_cuts[-1] = (last_start, max(last_end, end))
-        else:
-            merged_cuts.append((start, end))
-
-    return merged_cuts
-
-
-def apply_cuts(string, cuts):
-    """Applies the cuts to the string, removing the specified parts.
-
-    Args:
-        string: The input string.
-        cuts: A list of 2-tuples representing (start_index, end_index) of cuts.  These should be *merged* cuts.
-
-    Returns:
-        The modified string with the cuts applied.
-    """
-
-    if not cuts:
-        return string
-
-    # Important: Process cuts in reverse order to avoid index issues after deletions.
-    cuts.sort(reverse=True)  # Sort in reverse order of start index
-
-    modified_string = list(string)  # Make it mutable
-    for start, end in cuts:
-        if 0 <= start < len(modified_string) and 0 <= end <= len(modified_string) and start <= end:  # handle edge cases
-            modified_string[start:end] = []  # Efficient deletion using slice assignment
-
-    return "".join(modified_string)  # back to string
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+SEGMENT_MARKER = 'monoscript-profile-segment'
+
+# Executed with -X importtime: runs the merged module chunk by chunk (the header with the hoisted imports, then each
+# "# --- Start of <file> ---" segment) in a module namespace, timing each chunk, and marking the chunks on stderr.
+PROFILE_DRIVER_CODE = '''
+import json, re, sys, time, types
+module_name, file_path = sys.argv[1:3]
+with open(file_path, "r", encoding="utf-8") as f:
+    lines = f.readlines()
+chunks = [["<imports>", 0]]
+for ix, line in enumerate(lines):
+    match = re.match(r"# --- Start of (.+) ---$", line.rstrip())
+    if match:
+        chunks.append([match.group(1), ix])
+chunks = [(name, start, chunks[i + 1][1] if i + 1 < len(chunks) else len(lines)) for i, (name, start) in
+          enumerate(chunks)]
+module = types.ModuleType(module_name)
+module.__file__ = file_path
+sys.modules[module_name] = module
+timings = []
+for ix, (name, start, end) in enumerate(chunks):
+    code = compile("\\n" * start + "".join(lines[start:end]), file_path, "exec")
+    sys.stderr.write(f"MARKER {ix}\\n")
+    sys.stderr.flush()
+    start_time = time.perf_counter_ns()
+    exec(code, module.__dict__)
+    timings.append((name, (time.perf_counter_ns() - start_time) // 1000))
+sys.stderr.write("MARKER end\\n")
+sys.stderr.flush()
+print(json.dumps(timings))
+'''.replace('MARKER', SEGMENT_MARKER)
+
+
+@dataclass
+class ImportProfile:
+    """Import time of a merged module, in microseconds."""
+    total_us: int = 0
+    imports: dict[str, int] = field(default_factory=dict)  # hoisted import -> cumulative time
+    segments: dict[str, int] = field(default_factory=dict)  # file segment -> execution time, its imports included
+    segment_imports: dict[str, dict[str, int]] = field(default_factory=dict)  # segment -> import -> cumulative time
+
+    def top(self, count=10) -> list[tuple[str, int]]:
+        """Returns the count most expensive hoisted imports and segments."""
+        offenders = [(f"import {name}", us) for name, us in self.imports.items()] + \
+                    [(f"segment {name}", us) for name, us in self.segments.items() if name != '<imports>']
+        return sorted(offenders, key=lambda offender: (-offender[1], offender[0]))[:count]
+
+
+def parse_importtime(lines) -> list[tuple[int, str, int, int]]:
+    """Parses -X importtime lines into (level, module name, self us, cumulative us) entries."""
+    entries = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():  # header
+            continue
+        name = parts[2].rstrip('\n')
+        level = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((level, name.strip(), int(parts[0]), int(parts[1])))
+    return entries
+
+
+def profile_import(file_path, module_name, env: Optional[dict] = None, timeout: Optional[float] = None) \
+        -> ImportProfile:
+    """Executes the merged module file in a fresh interpreter with -X importtime and returns its ImportProfile."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROFILE_DRIVER_CODE, module_name,
+                             os.path.abspath(file_path)], cwd=os.path.dirname(os.path.abspath(file_path)),
+                            env=env, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {file_path} failed:\n{result.stderr[-2000:]}")
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    profile = ImportProfile(segments={name: us for name, us in timings})
+    profile.total_us = sum(profile.segments.values())
+
+    # split the importtime report by chunk, level 0 entries are imported by the chunk itself
+    chunk_lines = {}
+    current = None
+    for line in result.stderr.splitlines():
+        if line.startswith(SEGMENT_MARKER):
+            marker = line[len(SEGMENT_MARKER):].strip()
+            current = None if marker == 'end' else timings[int(marker)][0]
+            chunk_lines.setdefault(current, [])
+        elif current is not None:
+            chunk_lines[current].append(line)
+    for name, lines in chunk_lines.items():
+        if name is None:
+            continue
+        imports = {entry_name: cumulative for level, entry_name, _, cumulative in parse_importtime(lines)
+                   if level == 0}
+        if name == '<imports>':
+            profile.imports = imports
+        elif imports:
+            profile.segment_imports[name] = imports
+    return profile
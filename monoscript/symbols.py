@@ -0,0 +1,229 @@
+import ast
+from typing import Optional, Union
+
+# leaf nodes without names, never scheduled
+NAMELESS_LEAF_TYPES = frozenset(
+    [ast.Constant] + [node_type for base_type in (ast.expr_context, ast.operator, ast.boolop, ast.cmpop, ast.unaryop)
+                      for node_type in base_type.__subclasses__()])
+
+
+class Scope:
+    """Names bound and used in a module, class, function, lambda or comprehension scope."""
+    __slots__ = ('node', 'kind', 'parent', 'children', 'definitions', 'uses', 'parameters', 'globals', 'nonlocals')
+
+    def __init__(self, node: ast.AST, kind: str, parent: Optional['Scope'] = None):
+        self.node = node
+        self.kind = kind
+        self.parent = parent
+        self.children: list[Scope] = list()
+        self.definitions: dict[str, ast.AST] = dict()  # name -> statement binding it (last one wins)
+        self.uses: set[str] = set()
+        self.parameters: set[str] = set()
+        self.globals: set[str] = set()
+        self.nonlocals: set[str] = set()
+        if parent is not None:
+            parent.children.append(self)
+
+    def __repr__(self):
+        return f"Scope(kind={self.kind}, definitions={len(self.definitions)}, uses={len(self.uses)})"
+
+    def resolve(self, name: str) -> Optional['Scope']:
+        """Returns the scope where name is bound as seen from this scope, or None (e.g. builtins)."""
+        scope = self
+        if name in self.globals:
+            while scope.parent is not None:
+                scope = scope.parent
+
+        while scope is not None:
+            if name in scope.definitions and (scope is self or scope.kind != 'class') and \
+                    (scope.parent is None or name not in scope.globals and name not in scope.nonlocals):
+                return scope
+            scope = scope.parent
+        return None
+
+
+class SymbolTable:
+    def __init__(self, module: Scope):
+        self.module = module
+        self.scopes: dict[int, Scope] = dict()  # id(node) -> scope
+
+    def scope_of(self, node: ast.AST) -> Optional[Scope]:
+        """Returns the scope opened by node (module, class, function, lambda or comprehension node)."""
+        return self.scopes.get(id(node))
+
+    def iter_scopes(self):
+        stack = [self.module]
+        while stack:
+            scope = stack.pop()
+            yield scope
+            stack.extend(reversed(scope.children))
+
+    @staticmethod
+    def build(tree: ast.AST) -> 'SymbolTable':
+        return SymbolTableBuilder().build(tree)
+
+
+class SymbolTableBuilder(ast.NodeVisitor):
+    """Builds a SymbolTable in a single pass over the AST.
+
+    Children are scheduled on an explicit stack instead of being visited recursively, so deeply nested
+    expressions do not hit the recursion limit.
+    """
+
+    def __init__(self):
+        self.table: Optional[SymbolTable] = None
+        self.scope: Optional[Scope] = None
+        self.statement: Optional[ast.AST] = None
+        self._stack: list[tuple[ast.AST, Scope, ast.AST]] = list()
+
+    def build(self, tree: ast.AST) -> SymbolTable:
+        self.scope = None
+        self.table = SymbolTable(Scope(tree, 'module'))
+        self.table.scopes[id(tree)] = self.table.module
+        self._stack = [(tree, self.table.module, tree)]
+        visitors = dict()  # node type -> visitor method
+        while self._stack:
+            node, self.scope, self.statement = self._stack.pop()
+            if isinstance(node, (ast.stmt, ast.excepthandler)):
+                self.statement = node
+            visitor = visitors.get(type(node))
+            if visitor is None:
+                visitor = visitors[type(node)] = getattr(self, 'visit_' + type(node).__name__, self.generic_visit)
+            visitor(node)
+        return self.table
+
+    def new_scope(self, node: ast.AST, kind: str) -> Scope:
+        scope = Scope(node, kind, parent=self.scope)
+        self.table.scopes[id(node)] = scope
+        return scope
+
+    def schedule(self, *nodes: Optional[ast.AST], scope: Scope = None):
+        """Schedules nodes to be visited in order, in the given scope (current scope by default)."""
+        scope = scope or self.scope
+        self._stack.extend((node, scope, self.statement) for node in reversed(nodes) if node is not None)
+
+    def generic_visit(self, node):
+        children = list()
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                children.extend(item for item in value
+                                if isinstance(item, ast.AST) and type(item) not in NAMELESS_LEAF_TYPES)
+            elif isinstance(value, ast.AST) and type(value) not in NAMELESS_LEAF_TYPES:
+                children.append(value)
+        scope, statement = self.scope, self.statement
+        self._stack.extend((child, scope, statement) for child in reversed(children))
+
+    def bind(self, name: str, scope: Scope = None):
+        scope = scope or self.scope
+        if name in scope.globals:
+            module = self.table.module
+            module.definitions.setdefault(name, self.statement)
+        elif name in scope.nonlocals:
+            enclosing = scope.parent
+            while enclosing is not None and enclosing.kind not in ('function', 'lambda'):
+                enclosing = enclosing.parent
+            if enclosing is not None:
+                enclosing.definitions.setdefault(name, self.statement)
+        else:
+            scope.definitions[name] = self.statement
+
+    def bind_arguments(self, arguments: ast.arguments, scope: Scope, statement: ast.AST):
+        for arg in arguments.posonlyargs + arguments.args + [arguments.vararg] + arguments.kwonlyargs + \
+                [arguments.kwarg]:
+            if arg is not None:
+                scope.parameters.add(arg.arg)
+                scope.definitions[arg.arg] = statement
+
+    @staticmethod
+    def argument_annotations(arguments: ast.arguments):
+        return [arg.annotation for arg in arguments.posonlyargs + arguments.args + [arguments.vararg] +
+                arguments.kwonlyargs + [arguments.kwarg] if arg is not None]
+
+    # names
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, ast.Store):
+            self.bind(node.id)
+        else:
+            self.scope.uses.add(node.id)
+
+    def visit_Import(self, node: Union[ast.Import, ast.ImportFrom]):
+        for alias in node.names:
+            if alias.name != '*':
+                self.bind(alias.asname or alias.name.split('.')[0])
+
+    visit_ImportFrom = visit_Import
+
+    def visit_Global(self, node: ast.Global):
+        self.scope.globals.update(node.names)
+        for name in node.names:
+            self.scope.definitions[name] = node
+
+    def visit_Nonlocal(self, node: ast.Nonlocal):
+        self.scope.nonlocals.update(node.names)
+        for name in node.names:
+            self.scope.definitions[name] = node
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler):
+        if node.name:
+            self.bind(node.name)
+        self.generic_visit(node)
+
+    def visit_NamedExpr(self, node: ast.NamedExpr):
+        scope = self.scope
+        while scope.kind == 'comprehension':  # PEP 572: binds in the enclosing scope
+            scope = scope.parent
+        self.bind(node.target.id, scope=scope)
+        self.schedule(node.value)
+
+    def visit_MatchAs(self, node):
+        if node.name:
+            self.bind(node.name)
+        self.generic_visit(node)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node):
+        if node.rest:
+            self.bind(node.rest)
+        self.generic_visit(node)
+
+    # scopes
+    def visit_FunctionDef(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]):
+        self.bind(node.name)
+        scope = self.new_scope(node, 'function')
+        self.bind_arguments(node.args, scope, node)
+        self.schedule(*node.body, scope=scope)
+        self.schedule(*node.decorator_list, *node.args.defaults, *node.args.kw_defaults,
+                      *self.argument_annotations(node.args), node.returns)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node: ast.Lambda):
+        scope = self.new_scope(node, 'lambda')
+        self.bind_arguments(node.args, scope, self.statement)
+        self.schedule(node.body, scope=scope)
+        self.schedule(*node.args.defaults, *node.args.kw_defaults)
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.bind(node.name)
+        scope = self.new_scope(node, 'class')
+        self.schedule(*node.body, scope=scope)
+        self.schedule(*node.decorator_list, *node.bases, *node.keywords)
+
+    def visit_ListComp(self, node: Union[ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp]):
+        scope = self.new_scope(node, 'comprehension')
+        nodes = list()
+        for ix, generator in enumerate(node.generators):
+            nodes.append(generator.target)
+            if ix:  # the first iterator is evaluated in the enclosing scope
+                nodes.append(generator.iter)
+            nodes.extend(generator.ifs)
+        if isinstance(node, ast.DictComp):
+            nodes.extend((node.key, node.value))
+        else:
+            nodes.append(node.elt)
+        self.schedule(*nodes, scope=scope)
+        self.schedule(node.generators[0].iter)
+
+    visit_SetComp = visit_GeneratorExp = visit_DictComp = visit_ListComp
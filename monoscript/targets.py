@@ -0,0 +1,78 @@
+import importlib.util
+import io
+import marshal
+import subprocess
+import sys
+import zipfile
+from typing import Optional
+
+# timestamp of the zipapp entries, the earliest the zip format supports: zipimport ignores it for hash-based .pyc
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+ZIPAPP_MAIN_CODE = "import runpy\nrunpy.run_module({module_name!r}, run_name='__main__', alter_sys=True)\n"
+
+# Imports the module from a zipapp (path ends with .pyz) or from a directory, and checks that the precompiled code is
+# the one imported.
+VALIDATE_DRIVER_CODE = '''
+import importlib, importlib.util, sys
+module_name, path = sys.argv[1:3]
+sys.path.insert(0, path)
+if path.endswith(".pyz"):
+    module = importlib.import_module(module_name)
+    assert module.__file__.endswith(".pyc"), f"{module.__file__} imported instead of the precompiled module"
+else:
+    spec = importlib.util.find_spec(module_name)
+    with open(spec.origin, "rb") as f:
+        source = f.read()
+    with open(spec.cached, "rb") as f:
+        pyc = f.read()
+    assert pyc[:4] == importlib.util.MAGIC_NUMBER, f"{spec.cached} was compiled for another Python version"
+    assert pyc[8:16] == importlib.util.source_hash(source), f"{spec.cached} does not match {spec.origin}"
+    importlib.import_module(module_name)
+'''
+
+
+def compile_pyc(source: bytes, filename: str, check_source=True) -> bytes:
+    """Returns the content of a hash-based .pyc file of source (PEP 552), invalidated by the source hash rather than
+    by its modification time. With check_source, the import system checks the hash against the source file."""
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    flags = 0b01 | (0b10 if check_source else 0)
+    return importlib.util.MAGIC_NUMBER + flags.to_bytes(4, 'little') + importlib.util.source_hash(source) + \
+        marshal.dumps(code)
+
+
+def build_zipapp(source: bytes, module_name: str, interpreter: Optional[str] = None) -> bytes:
+    """Returns the content of a zipapp running module_name as __main__.
+
+    The archive holds the module source and its .pyc, at its root where zipimport looks for it (zipimport ignores
+    __pycache__ directories). The entries are sorted and timestamped with ZIP_EPOCH, the content is the same for the
+    same source.
+    """
+    buffer = io.BytesIO()
+    if interpreter:
+        buffer.write(b'#!' + interpreter.encode('utf-8') + b'\n')
+    entries = {
+        '__main__.py': ZIPAPP_MAIN_CODE.format(module_name=module_name).encode('utf-8'),
+        f'{module_name}.py': source,
+        f'{module_name}.pyc': compile_pyc(source, f'{module_name}.py'),
+    }
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in sorted(entries.items()):
+            entry = zipfile.ZipInfo(name, date_time=ZIP_EPOCH)
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            entry.external_attr = 0o644 << 16
+            archive.writestr(entry, data)
+    return buffer.getvalue()
+
+
+def validate_target(path, module_name, env: Optional[dict] = None, timeout: Optional[float] = None) \
+        -> Optional[str]:
+    """Imports module_name from a zipapp, or from a directory with its precompiled .pyc, in a fresh interpreter.
+
+    Returns the error output if the import failed or did not use the precompiled code, None otherwise.
+    """
+    result = subprocess.run([sys.executable, '-c', VALIDATE_DRIVER_CODE, module_name, path], env=env,
+                            capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        return result.stderr.strip()[-2000:] or f"exit code {result.returncode}"
+    return None
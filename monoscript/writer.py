@@ -0,0 +1,144 @@
+import errno
+import hashlib
+import os
+import tempfile
+import time
+from os.path import dirname, basename, join, exists, abspath
+from typing import Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Exclusive inter-process lock on a lock file, blocking until acquired.
+
+    On Windows, where a blocking msvcrt lock gives up after about 10 seconds, the lock is polled every poll_interval
+    seconds instead.
+    """
+
+    def __init__(self, lock_path, poll_interval=0.1):
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def acquire(self):
+        self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            else:
+                self._poll_msvcrt_lock()
+        except OSError:
+            os.close(self._fd)
+            self._fd = None
+            raise
+
+    def _poll_msvcrt_lock(self):
+        while True:
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EDEADLK):  # not held by another process
+                    raise
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def lock_path_for(file_path) -> str:
+    """Returns the path of the lock file of file_path, in the temporary directory so that it is never left next to
+    the output. The name is keyed by the absolute path, the lock is shared by all the writers of the same file."""
+    path_hash = hashlib.sha256(abspath(file_path).encode('utf-8')).hexdigest()[:16]
+    return join(tempfile.gettempdir(), f"monoscript-{basename(file_path)}-{path_hash}.lock")
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """Returns the sha256 hexdigest of the content of file_path."""
+    content_hash = hashlib.sha256()
+    with open(file_path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class AtomicWriter:
+    """Streams text to a temporary file in the directory of file_path, then renames it over file_path.
+
+    Writers of the same file are serialized with a lock file in the temporary directory, see lock_path_for. If the
+    block raises, or if discard() was called, the temporary file is removed and file_path is left untouched. With
+    skip_unchanged, file_path is also left untouched (unchanged is set) when its content hash matches the written
+    content. Bytes are written if encoding is None.
+    """
+
+    def __init__(self, file_path, encoding='utf-8', skip_unchanged=False):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.skip_unchanged = skip_unchanged
+        self.discarded = False
+        self.unchanged = False
+        self.lock = FileLock(lock_path_for(file_path))
+        self._tmp_path = None
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(dirname(self.file_path) or '.', exist_ok=True)
+        self.lock.acquire()
+        try:
+            self._tmp_path = join(dirname(self.file_path) or '.',
+                                  f".{basename(self.file_path)}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+            fd = os.open(self._tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            self._file = os.fdopen(fd, 'w', encoding=self.encoding) if self.encoding else os.fdopen(fd, 'wb')
+        except BaseException:
+            self.lock.release()
+            raise
+        return self
+
+    def write(self, text: Union[str, bytes]):
+        self._file.write(text)
+
+    def discard(self):
+        self.discarded = True
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        commit = exc_type is None and not self.discarded
+        try:
+            if commit:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+            if commit and self.skip_unchanged and exists(self.file_path) and \
+                    os.stat(self.file_path).st_size == os.stat(self._tmp_path).st_size and \
+                    file_hash(self.file_path) == file_hash(self._tmp_path):
+                self.unchanged = True
+                commit = False
+            if commit:
+                if exists(self.file_path):  # keep the permissions of the replaced file
+                    os.chmod(self._tmp_path, os.stat(self.file_path).st_mode & 0o7777)
+                os.replace(self._tmp_path, self.file_path)
+        finally:
+            if exists(self._tmp_path):  # discarded or failed
+                os.remove(self._tmp_path)
+            self.lock.release()
@@ -1,9 +1,17 @@
 import os
 import ast
+import json
+import shutil
+import subprocess
+import sys
+import threading
 import unittest
+import unittest.mock
 import tempfile
 
-from monoscript import PythonModuleMerger, ProcessAllStrategy, ImportConflictException, ScriptParser, main
+from monoscript import PythonModuleMerger, ProcessAllStrategy, ImportConflictException, ScriptParser, \
+    ImportGraph, FileDiscovery, BatchMerger, main
+from monoscript.writer import FileLock
 
 
 class TestPythonModuleMerger(unittest.TestCase):
@@ -41,6 +49,153 @@ class TestPythonModuleMerger(unittest.TestCase):
         parsed_code.remove_child(function_node)
         self.assertNotIn(inside_function_code, parsed_code.get_code())
 
+    def test_parser_statements_only(self):
+        filepath = "test_modules/parser_test.py"
+        with open(filepath) as fin:
+            code = fin.read()
+        parsed_code = ScriptParser(code, statements_only=True).parse()
+        self.assertTrue(all(isinstance(node.node, (ast.stmt, ast.excepthandler, ast.Module))
+                            for node in parsed_code.walk()))
+        self.assertFalse(hasattr(parsed_code, '__dict__'))
+
+        function_node = parsed_code.children[6]
+        self.assertIsInstance(function_node.node, ast.FunctionDef)
+        self.assertIn('import json', function_node.children[1].get_code())
+        self.assertIn('my_function', parsed_code.context)
+        self.assertIn('d', function_node.context)
+
+        # expressions are wrapped on demand
+        if_node = parsed_code.children[5]
+        test_node = if_node.wrap(if_node.node.test)
+        self.assertEqual('__name__ == "__main__"', test_node.get_code())
+        self.assertIs(if_node, test_node.parent)
+        self.assertEqual(3, len(test_node.children))
+
+    def test_parser_lazy_tree(self):
+        code = 'x = ' + ' + '.join(['1'] * 2000) + '\n'
+        parsed_code = ScriptParser(code).parse()
+        assign_node = parsed_code.children[0]
+        self.assertIsNone(assign_node._children)
+        self.assertIsNone(parsed_code.index.by_type)  # indexed on the first lookup
+        self.assertEqual(1, len(parsed_code.find_nodes(ast.Assign)))
+        self.assertIsNotNone(parsed_code.index.by_type)
+
+        # deeply nested expressions don't hit the recursion limit
+        parsed_code.build()
+        node = assign_node.children[1]
+        depth = 0
+        while node.children and isinstance(node.node, ast.BinOp):
+            node, depth = node.children[0], depth + 1
+        self.assertEqual(1999, depth)
+        self.assertEqual('1', node.get_code())
+
+    def test_parser_find_nodes(self):
+        filepath = "test_modules/parser_test.py"
+        with open(filepath) as fin:
+            code = fin.read()
+        for statements_only in (False, True):
+            parsed_code = ScriptParser(code, statements_only=statements_only).parse()
+            import_nodes = parsed_code.find_nodes(ast.Import, ast.ImportFrom)
+            self.assertEqual(15, len(import_nodes))
+            self.assertEqual('import os', import_nodes[0].get_code())
+            self.assertEqual(set(import_nodes), set(parsed_code.walk(ast.Import, ast.ImportFrom)))
+
+            function_node = parsed_code.children[6]
+            function_names = [node.node.name for node in function_node.find_nodes(ast.FunctionDef)]
+            self.assertEqual(['my_function', 'sub_func'], function_names)
+
+            # removed nodes are not found
+            function_node.remove()
+            self.assertEqual(11, len(parsed_code.find_nodes(ast.Import, ast.ImportFrom)))
+
+    def test_parser_removed_parts(self):
+        code = "x = 'é'; import os\nif x:\n    import sys  # comment\n    y = 'ü' + x\n"
+        parsed_code = ScriptParser(code).parse()
+        import_nodes = [node for node in parsed_code.walk() if isinstance(node.node, ast.Import)]
+        self.assertEqual(2, len(import_nodes))
+        for node in import_nodes:
+            node.remove()
+        self.assertEqual("x = 'é'; \nif x:\n    y = 'ü' + x", parsed_code.get_code())
+        self.assertEqual("if x:\n    y = 'ü' + x", parsed_code.children[1].get_code())
+        self.assertEqual(2, len(parsed_code.removals))
+        self.assertIs(parsed_code.removals, parsed_code.children[1].removals)
+        self.assertEqual([], parsed_code.children[1].children[1].removed_parts)
+
+    def test_parser_form_feed(self):
+        code = "a = 1\n\x0c\nb = 2\nimport json\n"
+        parsed_code = ScriptParser(code).parse()
+        import_node, = parsed_code.find_nodes(ast.Import)
+        self.assertEqual("import json", import_node.get_code())
+        import_node.remove()
+        self.assertEqual("a = 1\n\x0c\nb = 2", parsed_code.get_code())
+
+    def test_parser_remove_many(self):
+        code = ''.join(f"import m{i}\nx{i} = {i}\n" for i in range(5000))
+        parsed_code = ScriptParser(code, statements_only=True).parse()
+        parsed_code.remove_many(parsed_code.find_nodes(ast.Import))
+        self.assertEqual(5000, len(parsed_code.children))
+        self.assertEqual(5000, len(parsed_code.node.body))
+        self.assertEqual(5000, len(parsed_code.removals))
+        self.assertEqual(''.join(f"x{i} = {i}\n" for i in range(5000)).strip(), parsed_code.get_code())
+
+        with self.assertRaises(ValueError):
+            parsed_code.children[0].remove_child(parsed_code.children[1])
+        with self.assertRaises(ValueError):  # not a descendant
+            parsed_code.children[0].remove_many([parsed_code.children[1]])
+
+        # nodes of single node fields are rejected, nothing is removed
+        parsed_code = ScriptParser("if x:\n    y = 1\nelse:\n    z = 2\n    w = 3\n").parse()
+        if_node = parsed_code.children[0]
+        test_node, = [child for child in if_node.children if child.node is if_node.node.test]
+        with self.assertRaises(ValueError):
+            parsed_code.remove_many([if_node.children[-2], test_node])
+        self.assertEqual(0, len(parsed_code.removals))
+        parsed_code.remove_many([if_node.children[-2]])  # orelse statement
+        self.assertEqual(1, len(if_node.node.orelse))
+        self.assertEqual("if x:\n    y = 1\nelse:\n    w = 3", parsed_code.get_code())
+
+    def test_symbol_table(self):
+        code = ("import os.path\n"
+                "counter = 0\n"
+                "def f(a, *args, b=None, **kwargs):\n"
+                "    global counter\n"
+                "    counter += 1\n"
+                "    squares = [x * x for x in args if (last := x)]\n"
+                "    def g():\n"
+                "        nonlocal squares\n"
+                "        squares = None\n"
+                "        return os.path.join(a, b)\n"
+                "    return g\n"
+                "class C:\n"
+                "    attr = f\n"
+                "    def m(self):\n"
+                "        return attr\n")
+        parsed_code = ScriptParser(code).parse()
+        symbols = parsed_code.symbols
+        self.assertEqual({'os', 'counter', 'f', 'C'}, set(symbols.module.definitions))
+
+        function_node = parsed_code.children[2]
+        function_scope = symbols.scope_of(function_node.node)
+        self.assertEqual({'a', 'args', 'b', 'kwargs'}, function_scope.parameters)
+        self.assertEqual({'a', 'args', 'b', 'kwargs', 'counter', 'squares', 'last', 'g'},
+                         set(function_scope.definitions))
+        self.assertNotIn('x', function_scope.definitions)
+        self.assertIn('counter', function_node.context)
+        self.assertIs(function_node, function_node.context['a'])
+
+        comprehension_scope, g_scope = function_scope.children
+        self.assertEqual('comprehension', comprehension_scope.kind)
+        self.assertEqual({'x'}, set(comprehension_scope.definitions))
+        self.assertIs(function_scope, g_scope.resolve('squares'))
+        self.assertIs(function_scope, g_scope.resolve('a'))
+        self.assertIs(symbols.module, g_scope.resolve('os'))
+        self.assertIs(symbols.module, function_scope.resolve('counter'))
+        self.assertIn('os', g_scope.uses)
+
+        # class scope names are not visible from methods
+        method_scope = symbols.scope_of(parsed_code.children[3].node.body[1])
+        self.assertIsNone(method_scope.resolve('attr'))
+
     def test_is_internal_import(self):
         test_cases = [
             ("from module1.utils import x", True),
@@ -93,6 +248,9 @@ class TestPythonModuleMerger(unittest.TestCase):
              ['nested1/__init__.py'], ['nested1_b_function']),
             ("import module2_nested.nested1.c, module2_nested.nested1.b", "nested1/b.py",
              ['nested1/c/__init__.py', 'nested1/b.py'], None),
+            ("import module2_nested", "nested1/b.py", ['__init__.py'], None),
+            ("from ...nested1 import nested1_b_function", "nested1/b.py", [], ['nested1_b_function']),
+            ("from .missing import missing_function", "nested1/b.py", [], ['missing_function']),
 
         ]
 
@@ -100,11 +258,16 @@ class TestPythonModuleMerger(unittest.TestCase):
             import_node = ast.parse(statement).body[0]
             current_path = os.path.join(merger.module_path, cur_rel_path)
             import_paths = [os.path.join(merger.module_path, rel_path) for rel_path in
-                            import_rel_paths] if import_rel_paths else None
+                            import_rel_paths] if import_rel_paths is not None else None
             result = merger.process_internal_import(current_path, import_node)
             self.assertEqual(result[0], import_paths)
             self.assertEqual(result[1], imported_names)
 
+        # resolved from a single scan of the module directory
+        self.assertEqual(os.path.join(merger.module_path, 'nested2', 'c', 'ca', '__init__.py'),
+                         merger.module_map['module2_nested.nested2.c.ca'])
+        self.assertEqual(15, len(merger.module_map))
+
     def test_merge_simple(self):
         with tempfile.TemporaryDirectory() as tempdir:
             merger = PythonModuleMerger("test_modules/module1", output_dir=tempdir)
@@ -135,6 +298,776 @@ class TestPythonModuleMerger(unittest.TestCase):
             self.assertIn("from os.path import join", merged_code)
             self.assertNotIn("import sys\nfrom os.path import join", merged_code)
 
+    def test_merge_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache_dir = os.path.join(tempdir, 'cache')
+            merged_codes = []
+            for expected_hits, expected_misses in ((0, 3), (3, 0)):
+                merger = PythonModuleMerger("test_modules/module1", output_dir=tempdir, cache_dir=cache_dir,
+                                            run_test_scripts=False)
+                merger.merge_files()
+                self.assertEqual(expected_hits, merger.parse_cache.hits)
+                self.assertEqual(expected_misses, merger.parse_cache.misses)
+                with open(merger.output_file, 'r') as f:
+                    merged_codes.append(f.read().split('Generated On:')[1].split('\n', 1)[1])
+            self.assertEqual(merged_codes[0], merged_codes[1])
+
+            # touched files are validated by content hash
+            core_path = os.path.join(merger.module_path, 'core.py')
+            os.utime(core_path)
+            self.assertIsNotNone(merger.parse_cache.get(core_path, 'module1'))
+            self.assertIsNone(merger.parse_cache.get(core_path, 'other_module'))
+
+            # entries are stored with the stat taken before reading: a file edited meanwhile is parsed again
+            module_path = os.path.join(tempdir, 'module1')
+            shutil.copytree("test_modules/module1", module_path)
+            core_path = os.path.join(module_path, 'core.py')
+            stat = os.stat(core_path)
+            with open(core_path, 'r') as f:
+                parse_result = merger.parse_python_code(f.read())
+            with open(core_path, 'a') as fou:
+                fou.write("\n\ndef core_function():\n    pass\n")
+            merger.store_parse_result(core_path, (stat.st_size, stat.st_mtime_ns), parse_result)
+            self.assertIsNone(merger.parse_cache.get(core_path, 'module1'))
+
+            # removed files are misses
+            os.remove(core_path)
+            self.assertIsNone(merger.parse_cache.get(core_path, 'module1'))
+
+            # size bounded
+            merger.parse_cache.evict(max_size=0)
+            self.assertEqual(0, merger.parse_cache.total_size())
+
+    def test_merge_watch(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'module1')
+            shutil.copytree("test_modules/module1", module_path)
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'),
+                                        run_test_scripts=False)
+
+            core_path = os.path.join(module_path, 'core.py')
+            saving = threading.Event()
+
+            def _edit_core():
+                saving.set()
+                with open(core_path, 'a') as fou:
+                    fou.write("\n\ndef core_function():\n    pass\n")
+
+            def _parse_python_file(file_path, parse_python_file=merger.parse_python_file):
+                if file_path == core_path and saving.is_set():  # renamed by the editor while merging
+                    saving.clear()
+                    raise FileNotFoundError(file_path)
+                return parse_python_file(file_path)
+
+            merger.parse_python_file = _parse_python_file
+            timer = threading.Timer(0.2, _edit_core)
+            timer.start()
+            watcher = threading.Thread(target=merger.watch, kwargs=dict(interval=0.05, max_merges=3))
+            watcher.start()
+            watcher.join(timeout=30)
+            timer.join()
+            self.assertFalse(watcher.is_alive())
+            del merger.parse_python_file
+
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertIn("def core_function():", merged_code)
+            self.assertEqual(3, len(merger.processed_code))
+
+            # unchanged output is not rewritten
+            output_mtime = os.stat(merger.output_file).st_mtime_ns
+            parse_result = merger.parsed_files[os.path.join(merger.module_path, 'utils.py')][1]
+            merger.merge_files(write_unchanged=False)
+            self.assertEqual(output_mtime, os.stat(merger.output_file).st_mtime_ns)
+            self.assertIs(parse_result, merger.parsed_files[os.path.join(merger.module_path, 'utils.py')][1])
+
+    def test_merge_parallel(self):
+        module_codes = []
+        for jobs in (1, 3):
+            with tempfile.TemporaryDirectory() as tempdir:
+                merger = PythonModuleMerger("test_modules/module2_nested", output_dir=tempdir, jobs=jobs,
+                                            run_test_scripts=False)
+                merger.merge_files()
+                module_codes.append(merger.module_code_hash)
+                self.assertEqual(len(merger.parsed_files), len(merger.processed_code))
+        self.assertEqual(module_codes[0], module_codes[1])
+
+    def test_merge_import_graph(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'graph_module')
+            os.makedirs(module_path)
+            files = {
+                '__init__.py': "from .a import a_function\n",
+                '__main__.py': "from . import a_function\n\nif __name__ == '__main__':\n    a_function()\n",
+                'a.py': "from .b import b_function\n\n\ndef a_function():\n    return b_function()\n",
+                'b.py': "from .c import c_function\n\n\ndef b_function():\n    return c_function()\n",
+                'c.py': "def c_function():\n    from .d import d_function\n    return d_function()\n",
+                'd.py': "from .e import e_function as d_function\n",
+                'e.py': "from .d import d_function\n\n\ndef e_function():\n    pass\n",
+            }
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            for graph_filename in ('graph.json', 'graph.dot'):
+                graph_file = os.path.join(tempdir, graph_filename)
+                merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'),
+                                            run_test_scripts=False, graph_file=graph_file)
+                merger.merge_files()
+                self.assertEqual(['c.py', 'b.py', 'a.py', '__init__.py', 'e.py', 'd.py', '__main__.py'],
+                                 [rel_path for _, rel_path in merger.processed_code])
+                self.assertEqual(['a.py'], merger.import_graph.imports['__init__.py'])
+                self.assertEqual([], merger.import_graph.imports['c.py'])  # not top-level
+                self.assertEqual([['d.py', 'e.py']], merger.import_graph.find_cycles())
+                with open(graph_file) as f:
+                    graph_content = f.read()
+                if graph_filename.endswith('.json'):
+                    self.assertEqual(merger.import_graph.to_dict(), json.loads(graph_content))
+                else:
+                    self.assertIn('"__main__.py" -> "__init__.py";', graph_content)
+
+        # long import chains
+        graph = ImportGraph()
+        for ix in range(5000):
+            graph.add_import(f"m{ix}.py", f"m{ix + 1}.py")
+        self.assertEqual([f"m{ix}.py" for ix in range(5000, -1, -1)], graph.topological_order())
+        graph.add_import("m5000.py", "m0.py")
+        self.assertEqual(1, len(graph.find_cycles()))
+
+    def test_file_discovery(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.makedirs(os.path.join(tempdir, '.git'))
+            with open(os.path.join(tempdir, '.gitignore'), 'w') as fou:
+                fou.write("# generated\n/pkg/build/\n*_generated.py\n!keep_generated.py\n")
+            module_path = os.path.join(tempdir, 'pkg')
+            for rel_path in ('__init__.py', 'core.py', 'notes.txt', 'sub/__init__.py', 'sub/a_generated.py',
+                             'sub/keep_generated.py', 'sub/build/x.py', 'build/y.py', '__pycache__/core.py',
+                             '.hidden/z.py', 'venv/pyvenv.cfg', 'venv/lib/site.py', 'sub/legacy/old.py'):
+                os.makedirs(os.path.dirname(os.path.join(module_path, rel_path)), exist_ok=True)
+                with open(os.path.join(module_path, rel_path), 'w') as fou:
+                    fou.write("")
+            with open(os.path.join(module_path, 'sub', '.gitignore'), 'w') as fou:
+                fou.write("legacy/\n")
+
+            self.assertEqual(['__init__.py', 'core.py', 'build/y.py', 'sub/__init__.py', 'sub/a_generated.py',
+                              'sub/keep_generated.py', 'sub/build/x.py', 'sub/legacy/old.py'],
+                             [rel_path.replace(os.sep, '/') for rel_path in FileDiscovery(module_path).scan()])
+            self.assertEqual(['__init__.py', 'core.py', 'sub/__init__.py', 'sub/keep_generated.py', 'sub/build/x.py'],
+                             [rel_path.replace(os.sep, '/') for rel_path in
+                              FileDiscovery(module_path, use_gitignore=True).scan()])
+            self.assertEqual(['core.py', 'notes.txt'],
+                             [rel_path.replace(os.sep, '/') for rel_path in
+                              FileDiscovery(module_path, include=['*.py', '*.txt'], exclude=['__init__.py', 'sub/'],
+                                            recursive=False).scan()])
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        exclude=['build/'], use_gitignore=True)
+            merger.merge_files()
+            self.assertEqual(['__init__.py', 'core.py', 'sub/__init__.py', 'sub/keep_generated.py'],
+                             sorted(rel_path.replace(os.sep, '/') for _, rel_path in merger.processed_code))
+
+    def test_merge_atomic_output(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            # concurrent merges into the same output directory
+            mergers = [PythonModuleMerger("test_modules/module1", output_dir=tempdir, run_test_scripts=False)
+                       for _ in range(4)]
+            threads = [threading.Thread(target=merger.merge_files) for merger in mergers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with open(mergers[0].output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertEqual(1, merged_code.count("class CoreClass:"))
+            self.assertTrue(merged_code.endswith("# --- End of __init__.py ---\n\n\n"))
+            os.chmod(mergers[0].output_file, 0o640)
+
+            # failed merges leave the output untouched
+            merger = PythonModuleMerger("test_modules/module5_import_conflicts", output_dir=tempdir,
+                                        module_name='module1', run_test_scripts=False)
+            with self.assertRaises(ImportConflictException):
+                merger.merge_files()
+            with open(mergers[0].output_file, 'r') as f:
+                self.assertEqual(merged_code, f.read())
+            self.assertEqual(['module1.py'], os.listdir(tempdir))  # no temporary or lock file left
+
+            # permissions are kept
+            mergers[0].merge_files()
+            self.assertEqual(0o640, os.stat(mergers[0].output_file).st_mode & 0o777)
+
+            # the Windows lock is polled while held by another process, instead of giving up
+            calls = []
+
+            def _locking(fd, mode, nbytes):
+                calls.append(mode)
+                if len(calls) < 3:
+                    raise PermissionError(13, 'Permission denied')
+
+            fake_msvcrt = unittest.mock.Mock(LK_NBLCK=2, LK_UNLCK=0, locking=_locking)
+            with unittest.mock.patch('monoscript.writer.fcntl', None), \
+                    unittest.mock.patch('monoscript.writer.msvcrt', fake_msvcrt, create=True):
+                with FileLock(os.path.join(tempdir, 'file.lock'), poll_interval=0.01):
+                    self.assertEqual([2, 2, 2], calls)
+            self.assertEqual([2, 2, 2, 0], calls)
+
+    def test_merge_reproducible(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'module1')
+            shutil.copytree("test_modules/module1", module_path)
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(module_path, output_dir=output_dir, run_test_scripts=False, reproducible=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertNotIn("Generated On:", merged_code)
+
+            # unchanged output is not rewritten
+            output_mtime = os.stat(merger.output_file).st_mtime_ns
+            merger.merge_files()
+            self.assertEqual(output_mtime, os.stat(merger.output_file).st_mtime_ns)
+            self.assertTrue(merger.check())
+
+            with unittest.mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1700000000'}):
+                self.assertFalse(merger.check())
+                self.assertIn("Generated On: 2023-11-14 22:13:20", merger.generate_code())
+
+            # --check
+            main([module_path, '-D', output_dir, '--check'])
+            with open(os.path.join(module_path, 'core.py'), 'a') as fou:
+                fou.write("\n\ndef core_function():\n    pass\n")
+            with self.assertRaises(SystemExit):
+                main([module_path, '-D', output_dir, '--check'])
+            with open(merger.output_file, 'r') as f:
+                self.assertEqual(merged_code, f.read())
+
+    def test_merge_batch(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache_dir = os.path.join(tempdir, 'cache')
+            batch_merger = main(['test_modules/module1', 'test_modules/module2_nested', '-D', tempdir, '-j', '2',
+                                 '--cache-dir', cache_dir, '--no-run-test-scripts'])
+            self.assertEqual([('module1', True, 3), ('module2_nested', True, 15)],
+                             [(result.module_name, result.ok, result.files) for result in batch_merger.results])
+            self.assertIs(batch_merger.parse_cache, batch_merger.mergers[1].parse_cache)
+            self.assertEqual(18, batch_merger.parse_cache.misses)
+            for merger in batch_merger.mergers:
+                self.assertTrue(os.path.exists(merger.output_file))
+
+            # manifest, failures are reported without stopping the batch
+            manifest_path = os.path.join(tempdir, 'manifest.json')
+            with open(manifest_path, 'w') as fou:
+                json.dump({'defaults': {'run_test_scripts': False, 'output_dir': 'manifest_dist'},
+                           'modules': [os.path.abspath('test_modules/module5_import_conflicts'),
+                                       {'module_path': os.path.abspath('test_modules/module1'),
+                                        'module_name': 'renamed_module1', 'reproducible': True}]}, fou)
+            batch_merger = BatchMerger.from_manifest(manifest_path, module_paths=['test_modules/module2_nested'],
+                                                     output_dir=tempdir, run_test_scripts=False)
+            self.assertFalse(batch_merger.merge_all())
+            self.assertEqual([('module5_import_conflicts', False), ('renamed_module1', True), ('module2_nested', True)],
+                             [(result.module_name, result.ok) for result in batch_merger.results])
+            self.assertIn('ImportConflictException', batch_merger.results[0].error)
+            self.assertTrue(os.path.exists(os.path.join(tempdir, 'manifest_dist', 'renamed_module1.py')))
+            self.assertTrue(BatchMerger([batch_merger.mergers[1]]).merge_all(check=True))
+
+            # unexpected errors are reported too
+            broken_path = os.path.join(tempdir, 'broken_module')
+            os.makedirs(broken_path)
+            with open(os.path.join(broken_path, '__init__.py'), 'wb') as fou:
+                fou.write(b"TEXT = '\xff'\n")
+            batch_merger = BatchMerger.from_paths([broken_path, 'test_modules/module1'], output_dir=tempdir,
+                                                  run_test_scripts=False)
+            self.assertFalse(batch_merger.merge_all())
+            self.assertEqual([('broken_module', False), ('module1', True)],
+                             [(result.module_name, result.ok) for result in batch_merger.results])
+            self.assertIn('UnicodeDecodeError', batch_merger.results[0].error)
+
+            # a failed module fails the batch command
+            with self.assertRaises(SystemExit) as context:
+                main(['test_modules/module5_import_conflicts', 'test_modules/module1', '-D', tempdir,
+                      '--no-run-test-scripts'])
+            self.assertEqual(1, context.exception.code)
+
+    def test_merge_lazy_imports(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            # a third-party package recording when it is loaded
+            for rel_path, code in (('heavy/__init__.py', "import builtins\nbuiltins.heavy_loaded = True\n"),
+                                   ('heavy/sub.py', "VALUE = 42\n"),
+                                   ('lazy_module/__init__.py', "from .api import use_heavy\n"),
+                                   ('lazy_module/api.py', "import json\nimport heavy\nimport heavy.sub as hs\n\n\n"
+                                                          "def use_heavy():\n    return heavy.sub.VALUE, hs.VALUE\n")):
+                os.makedirs(os.path.dirname(os.path.join(tempdir, rel_path)), exist_ok=True)
+                with open(os.path.join(tempdir, rel_path), 'w') as fou:
+                    fou.write(code)
+
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(os.path.join(tempdir, 'lazy_module'), output_dir=output_dir,
+                                        run_test_scripts=False, lazy_imports=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertIn("import json\n", merged_code)
+            self.assertIn("heavy = _monoscript_lazy_import('heavy')", merged_code)
+            self.assertIn("hs = _monoscript_lazy_import('heavy.sub')", merged_code)
+
+            script = ("import builtins, lazy_module\n"
+                      "print(hasattr(builtins, 'heavy_loaded'))\n"
+                      "print(lazy_module.use_heavy(), hasattr(builtins, 'heavy_loaded'))\n")
+            result = subprocess.run([sys.executable, '-c', script], cwd=output_dir, capture_output=True, text=True,
+                                    env=dict(os.environ, PYTHONPATH=tempdir))
+            self.assertEqual("False\n(42, 42) True\n", result.stdout, result.stderr)
+
+            # the standard library modules are unknown before Python 3.10
+            with unittest.mock.patch('monoscript.merger.STDLIB_MODULE_NAMES', None):
+                with self.assertRaises(ValueError):
+                    PythonModuleMerger(os.path.join(tempdir, 'lazy_module'), run_test_scripts=False,
+                                       lazy_imports=True)
+
+    def test_merge_profile_import(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            for rel_path, code in (('site/slow_dep.py', "import time\ntime.sleep(0.05)\n"),
+                                   ('profiled_module/__init__.py', "from .core import core_function\n"),
+                                   ('profiled_module/core.py', "import slow_dep\n\n\ndef core_function():\n"
+                                                               "    return slow_dep\n")):
+                os.makedirs(os.path.dirname(os.path.join(tempdir, rel_path)), exist_ok=True)
+                with open(os.path.join(tempdir, rel_path), 'w') as fou:
+                    fou.write(code)
+
+            with unittest.mock.patch.dict(os.environ, {'PYTHONPATH': os.path.join(tempdir, 'site')}):
+                merger = PythonModuleMerger(os.path.join(tempdir, 'profiled_module'),
+                                            output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                            profile_import=True, import_time_budget=10000)
+                self.assertTrue(merger.merge_files())
+                self.assertEqual('import slow_dep', merger.import_profile.top(1)[0][0])
+                self.assertGreaterEqual(merger.import_profile.imports['slow_dep'], 50000)
+                self.assertEqual(['<imports>', 'core.py', '__init__.py'], list(merger.import_profile.segments))
+                self.assertGreaterEqual(merger.import_profile.total_us, 50000)
+
+                merger.import_time_budget = 10
+                self.assertFalse(merger.merge_files())
+                self.assertTrue(merger.import_time_budget_exceeded)
+
+            # the time is attributed to the segments by their markers, missing from these outputs
+            for option in ('minify', 'lazy_segments', 'bundle'):
+                with self.assertRaises(ValueError):
+                    PythonModuleMerger(os.path.join(tempdir, 'profiled_module'), run_test_scripts=False,
+                                       profile_import=True, **{option: 1})
+
+    def test_merge_tree_shake(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            files = {
+                '__init__.py': "from .api import public_function, PublicClass\n\n__all__ = ['public_function']\n",
+                '__main__.py': "from .api import public_function\n\n\ndef main():\n    print(public_function())\n",
+                'api.py': "import csv\nimport json\nfrom .registry import register, make_cache\n\n"
+                          "_CACHE = make_cache()\n\n\n"
+                          "def public_function() -> 'Result':\n    return helper()\n\n\n"
+                          "def helper():\n    return json.dumps([])\n\n\n"
+                          "def unused_helper():\n    return csv.reader([])\n\n\n"
+                          "@register\ndef registered():\n    pass\n\n\n"
+                          "class Result:\n    pass\n\n\n"
+                          "class PublicClass:\n    pass\n\n\nclass UnusedClass(PublicClass):\n    pass\n",
+                'registry.py': "REGISTRY = []\n\n\ndef register(function):\n    REGISTRY.append(function)\n"
+                               "    return function\n\n\ndef make_cache():\n    return {}\n\n\n"
+                               "def unused_registry_function():\n    pass\n",
+            }
+            module_path = os.path.join(tempdir, 'shaken_module')
+            os.makedirs(module_path)
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        tree_shake=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            for kept in ('def public_function(', 'def helper(', 'def registered(', 'class Result:', 'def main(',
+                         'def register(', 'def make_cache(', 'class PublicClass:', 'import json\n'):
+                self.assertIn(kept, merged_code)
+            for removed in ('unused_helper', 'unused_registry_function', 'UnusedClass', 'import csv'):
+                self.assertNotIn(removed, merged_code)
+            self.assertEqual({'api.py': ['unused_helper', 'UnusedClass'], 'registry.py': ['unused_registry_function']},
+                             {rel_path: [definition.name for definition in definitions]
+                              for rel_path, definitions in merger.removed_definitions.items()})
+
+            namespace = {}
+            exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+            self.assertEqual('[]', namespace['public_function']())
+            self.assertEqual(['registered'], [function.__name__ for function in namespace['REGISTRY']])
+
+    def test_merge_tree_shake_star_import(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'star_shaken_module')
+            os.makedirs(module_path)
+            files = {
+                '__init__.py': "from os.path import *\nfrom .helpers import *\n\n__all__ = ['joined']\n\n\n"
+                               "def joined():\n    return join(PREFIX, 'b') + globals()['suffix']()\n",
+                'helpers.py': "PREFIX = 'a'\n\n\ndef suffix():\n    return '!'\n",
+            }
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        tree_shake=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertEqual({}, merger.removed_definitions)
+            self.assertIn('from os.path import *\n', merged_code)
+
+            namespace = {}
+            exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+            self.assertEqual(os.path.join('a', 'b') + '!', namespace['joined']())
+
+    def test_merge_tree_shake_implicit_roots(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'implicit_module')
+            os.makedirs(module_path)
+            files = {
+                '__init__.py': "from .plugins import Base, Meta\n\n__all__ = ['Base', 'Meta']\n\n\n"
+                               "def __getattr__(name):\n    if name == 'legacy':\n        return 'legacy'\n"
+                               "    raise AttributeError(name)\n\n\ndef __dir__():\n    return __all__ + ['legacy']\n",
+                'plugins.py': "class Base:\n    registry = []\n\n    def __init_subclass__(cls, **kwargs):\n"
+                              "        super().__init_subclass__(**kwargs)\n"
+                              "        Base.registry.append(cls.__name__)\n\n\n"
+                              "class Plugin(Base):\n    pass\n\n\nclass SubPlugin(Plugin):\n    pass\n\n\n"
+                              "class Meta(type):\n    registry = []\n\n    def __init__(cls, *args):\n"
+                              "        super().__init__(*args)\n        Meta.registry.append(cls.__name__)\n\n\n"
+                              "class Registered(metaclass=Meta):\n    pass\n\n\nclass SubRegistered(Registered):\n"
+                              "    pass\n\n\nclass Unused:\n    pass\n",
+            }
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        tree_shake=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertEqual(['Unused'], [definition.name for definitions in merger.removed_definitions.values()
+                                          for definition in definitions])
+
+            namespace = {}
+            exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+            self.assertEqual(['Plugin', 'SubPlugin'], namespace['Base'].registry)
+            self.assertEqual(['Registered', 'SubRegistered'], namespace['Meta'].registry)
+            self.assertEqual('legacy', namespace['__getattr__']('legacy'))
+            self.assertIn('legacy', namespace['__dir__']())
+
+            # definitions and references are only summarized for the merges using them
+            self.assertTrue(all(parse_result.definitions is not None for parse_result, _ in merger.processed_code))
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False)
+            merger.merge_files()
+            self.assertTrue(all(parse_result.definitions is None for parse_result, _ in merger.processed_code))
+
+    def test_merge_unused_imports(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            files = {
+                '__init__.py': "from .a import dump\n",
+                'a.py': "import csv\nimport json\nimport sqlite3\nfrom os.path import join, exists\n"
+                        "from typing import Optional\n\n\n"
+                        "def dump(value) -> 'Optional[str]':\n    return json.dumps(join('a', value))\n",
+                'b.py': "import csv\nimport this_module_does_not_exist\n",
+            }
+            module_path = os.path.join(tempdir, 'imports_module')
+            os.makedirs(module_path)
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        remove_unused_imports=True, keep_imports=['sqlite3'])
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            for kept in ('import json\n', 'import sqlite3\n', 'from os.path import join\n',
+                         'from typing import Optional\n'):
+                self.assertIn(kept, merged_code)
+            self.assertEqual(['import csv', 'import this_module_does_not_exist', 'from os.path import exists'],
+                             merger.removed_imports)
+            self.assertIn('def dump(', merged_code)
+
+            namespace = {}
+            exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+            self.assertEqual('"a/b"', namespace['dump']('b'))
+
+    def test_merge_unused_imports_star(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'star_module')
+            os.makedirs(module_path)
+            with open(os.path.join(module_path, '__init__.py'), 'w') as fou:
+                fou.write("from os.path import *\nimport csv\n\n\ndef joined():\n    return join('a', 'b')\n")
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), run_test_scripts=False,
+                                        remove_unused_imports=True)
+            merger.merge_files()
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertIn('from os.path import *\n', merged_code)
+            self.assertEqual(['import csv'], merger.removed_imports)
+
+            namespace = {}
+            exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+            self.assertEqual(os.path.join('a', 'b'), namespace['joined']())
+
+    def test_merge_form_feed(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'form_feed_module')
+            os.makedirs(module_path)
+            with open(os.path.join(module_path, '__init__.py'), 'w') as fou:
+                fou.write("a = 1\n\x0c\nb = 2\nimport json\n")
+
+            for minify in (0, 1):
+                merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, f'dist{minify}'),
+                                            run_test_scripts=False, minify=minify)
+                merger.merge_files()
+                with open(merger.output_file, 'r') as f:
+                    merged_code = f.read()
+                self.assertIn('b = 2\n', merged_code)
+                self.assertEqual(1, merged_code.count('json'))  # the hoisted import only
+
+                namespace = {}
+                exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+                self.assertEqual((1, 2), (namespace['a'], namespace['b']))
+
+    def test_merge_minify(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            files = {
+                '__init__.py': '"""Package docstring."""\nfrom .a import Point, scale, TEXT, Abstract\n'
+                               'from .b import show\n',
+                'a.py': '# leading comment\nfrom dataclasses import dataclass\n\n\n'
+                        '@dataclass\nclass Point:\n    """A point."""\n    x: int = 0  # abscissa\n    y: int = 0\n\n\n'
+                        'def scale(point: Point, factor: float = 2) -> Point:\n    """Scales."""\n\n'
+                        '    result: Point = Point(point.x * factor, point.y * factor)\n    return result\n\n\n'
+                        'TEXT = """first\n\nthird  # not a comment"""\n\n\n'
+                        'class Abstract:\n    def method(self):\n        """Only a docstring."""\n',
+                'b.py': 'from functools import singledispatch\n\n\n@singledispatch\ndef show(x) -> str:\n'
+                        '    return "object"\n\n\n@show.register\ndef _(x: int) -> str:\n    return "int"\n',
+            }
+            module_path = os.path.join(tempdir, 'minified_module')
+            os.makedirs(module_path)
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            sizes = []
+            for level in (0, 1, 2, 3):
+                merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, f'dist{level}'),
+                                            run_test_scripts=False, minify=level)
+                merger.merge_files()
+                with open(merger.output_file, 'r') as f:
+                    merged_code = f.read()
+                module_code = merger.generate_module_code()
+                sizes.append(len(module_code))
+
+                namespace = {}
+                exec(compile(merged_code, merger.output_file, 'exec'), namespace)
+                point = namespace['scale'](namespace['Point'](1, 2))
+                self.assertEqual((2, 4), (point.x, point.y))
+                self.assertEqual(('int', 'object'), (namespace['show'](1), namespace['show']('1')))
+                self.assertEqual('first\n\nthird  # not a comment', namespace['TEXT'])
+                self.assertEqual(['x', 'y'], list(namespace['Point'].__dataclass_fields__))
+                self.assertIsNone(namespace['Abstract']().method())
+                if level == 0:
+                    self.assertIsNone(merger.minify_report)
+                    self.assertIn('# --- Start of a.py ---', module_code)
+                    continue
+
+                self.assertGreater(merger.minify_report.original_size, merger.minify_report.minified_size)
+                for removed in ('# --- Start of', '# leading comment', '# abscissa', 'A point.', 'Scales.',
+                                'Only a docstring.', '\n\n\n'):
+                    self.assertNotIn(removed, module_code)
+                self.assertEqual(level < 2, 'factor: float' in module_code)
+                self.assertEqual(level < 2, '-> Point' in module_code)
+                self.assertIn({1: 'def scale(point: Point, factor: float = 2) -> Point:',
+                               2: 'def scale(point, factor = 2):', 3: 'def scale(point, factor=2):'}[level],
+                              module_code)
+                self.assertIn('def _(x: int) -> str:', module_code)
+                self.assertEqual(level < 2, 'result: Point' in module_code)
+                self.assertIn('x: int = 0', module_code)
+            self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+    def test_merge_output_targets(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'app_module')
+            os.makedirs(module_path)
+            os.makedirs(os.path.join(tempdir, 'tests'))
+            files = {
+                os.path.join(module_path, '__init__.py'): "from .core import greet\n",
+                os.path.join(module_path, 'core.py'): "def greet(name):\n    return f'Hello {name}!'\n",
+                os.path.join(module_path, '__main__.py'): "import sys\nfrom .core import greet\n\n"
+                                                          "if __name__ == '__main__':\n    print(greet(sys.argv[1]))\n",
+                os.path.join(tempdir, 'tests', 'test_app.py'): "import app_module\n"
+                                                               "assert app_module.greet('a') == 'Hello a!'\n",
+            }
+            for file_path, code in files.items():
+                with open(file_path, 'w') as fou:
+                    fou.write(code)
+
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(module_path, output_dir=output_dir, reproducible=True, pyc=True, zipapp=True)
+            self.assertTrue(merger.merge_files())
+            self.assertEqual(os.path.join(output_dir, '__pycache__', f'app_module.{sys.implementation.cache_tag}.pyc'),
+                             merger.pyc_file)
+            with open(merger.pyc_file, 'rb') as f:
+                self.assertEqual(3, int.from_bytes(f.read()[4:8], 'little'))  # hash-based, checked
+            result = subprocess.run([merger.zipapp_file, 'zip'], capture_output=True, text=True)
+            self.assertEqual('Hello zip!', result.stdout.strip())
+
+            # deterministic
+            with open(merger.zipapp_file, 'rb') as f:
+                zipapp_content = f.read()
+            shutil.rmtree(output_dir)
+            self.assertTrue(merger.merge_files())
+            with open(merger.zipapp_file, 'rb') as f:
+                self.assertEqual(zipapp_content, f.read())
+            self.assertTrue(merger.check())
+
+            # stale targets
+            with open(merger.pyc_file, 'r+b') as f:
+                f.seek(8)
+                f.write(b'\0' * 8)
+            self.assertFalse(merger.check())
+            self.assertFalse(merger.validate_targets())
+
+    def test_merge_bundle(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'bundled_module')
+            files = {
+                '__init__.py': "from .a import value_a\nfrom .b import value_b\n\n__all__ = ['value_a', 'value_b']\n",
+                'a.py': "def helper():\n    return 'a'\n\n\ndef value_a():\n    return helper()\n",
+                'b.py': "def helper():\n    return 'b'\n\n\ndef value_b():\n    return helper()\n",
+                os.path.join('sub', 'inner.py'): "from ..a import value_a\n\nNAME = __name__ + value_a()\n",
+                '__main__.py': "import sys\nfrom . import value_a, value_b\nfrom .sub import inner\n\n"
+                               "if __name__ == '__main__':\n    print(value_a() + value_b() + inner.NAME)\n",
+            }
+            for filename, code in files.items():
+                os.makedirs(os.path.dirname(os.path.join(module_path, filename)), exist_ok=True)
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(module_path, output_dir=output_dir, run_test_scripts=False, bundle=True)
+            merger.merge_files()
+            self.assertEqual({}, merger.global_context_conflicts)
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            self.assertNotIn("return 'a'", merged_code)  # compiled, not merged
+
+            result = subprocess.run([sys.executable, '-c',
+                                     "import sys, bundled_module\nfrom bundled_module.sub import inner\n"
+                                     "print(bundled_module.value_a(), bundled_module.value_b(), inner.NAME, "
+                                     "bundled_module.__all__, 'helper' in dir(bundled_module), "
+                                     "sys.modules['bundled_module.a'].__name__)"],
+                                    cwd=output_dir, capture_output=True, text=True)
+            self.assertEqual("a b bundled_module.sub.innera ['value_a', 'value_b'] False bundled_module.a",
+                             result.stdout.strip(), result.stderr)
+
+            result = subprocess.run([sys.executable, merger.output_file], capture_output=True, text=True)
+            self.assertEqual('abbundled_module.sub.innera', result.stdout.strip(), result.stderr)
+
+            # the code transformations do not apply to compiled files
+            for option in ('tree_shake', 'remove_unused_imports', 'minify', 'lazy_imports', 'lazy_segments'):
+                with self.assertRaises(ValueError):
+                    PythonModuleMerger(module_path, output_dir=output_dir, run_test_scripts=False, bundle=True,
+                                       **{option: 1})
+
+    def test_merge_lazy_segments(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'lazy_module')
+            os.makedirs(module_path)
+            files = {
+                '__init__.py': "from .cheap import cheap, fail\nfrom .expensive import Expensive\n",
+                'cheap.py': "LOG = []\n\n\ndef cheap():\n    return 'cheap'\n\n\ndef fail():\n"
+                            "    raise ValueError('boom')\n",
+                'expensive.py': "from .cheap import LOG\n\nLOG.append('expensive')\n\n\nclass Expensive:\n"
+                                "    TEXT = '''a\n\nb'''\n",
+                'plugin.py': "from .cheap import LOG\n\nLOG.append('plugin')\n",
+                '__main__.py': "from .cheap import cheap\n\nif __name__ == '__main__':\n    print(cheap())\n",
+            }
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(module_path, output_dir=output_dir, run_test_scripts=False,
+                                        lazy_segments=True)
+            merger.merge_files()
+            script = ("import pickle, traceback, lazy_module\n"
+                      "print(lazy_module.LOG, 'Expensive' in vars(lazy_module), 'Expensive' in dir(lazy_module))\n"
+                      "print(lazy_module.Expensive.TEXT == 'a\\n\\nb', lazy_module.LOG)\n"
+                      "print(type(pickle.loads(pickle.dumps(lazy_module.Expensive()))).__qualname__)\n"
+                      "print(hasattr(lazy_module, 'missing'))\n"
+                      "try:\n    lazy_module.fail()\nexcept ValueError:\n"
+                      "    print('lazy_module/cheap.py' in traceback.format_exc(), "
+                      "\"raise ValueError('boom')\" in traceback.format_exc())\n")
+            with open(merger.output_file, 'r') as f:
+                merged_code = f.read()
+            for magic_line in ('', "_monoscript_segments_magic = b'other version'\n"):
+                if magic_line:  # the code objects are ignored, the sources compiled
+                    with open(merger.output_file, 'w') as fou:
+                        fou.write(''.join(magic_line if line.startswith('_monoscript_segments_magic = ') else line
+                                          for line in merged_code.splitlines(True)))
+                result = subprocess.run([sys.executable, '-c', script], cwd=output_dir, capture_output=True,
+                                        text=True)
+                self.assertEqual("['plugin'] False True\nTrue ['plugin', 'expensive']\nExpensive\nFalse\nTrue True",
+                                 result.stdout.strip(), result.stderr)
+
+                result = subprocess.run([sys.executable, merger.output_file], capture_output=True, text=True)
+                self.assertEqual('cheap', result.stdout.strip(), result.stderr)
+
+    def test_merge_lazy_segments_nested_import(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'nested_module')
+            os.makedirs(module_path)
+            files = {
+                '__init__.py': "from .a import f\n",
+                'a.py': "def f():\n    from .b import g\n    return g()\n",
+                'b.py': "def g():\n    return 'g'\n",
+            }
+            for filename, code in files.items():
+                with open(os.path.join(module_path, filename), 'w') as fou:
+                    fou.write(code)
+
+            output_dir = os.path.join(tempdir, 'dist')
+            merger = PythonModuleMerger(module_path, output_dir=output_dir, run_test_scripts=False,
+                                        lazy_segments=True)
+            merger.merge_files()
+            result = subprocess.run([sys.executable, '-c', "import nested_module\nprint(nested_module.f())"],
+                                    cwd=output_dir, capture_output=True, text=True)
+            self.assertEqual('g', result.stdout.strip(), result.stderr)
+
+    def test_run_test_scripts_parallel(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_path = os.path.join(tempdir, 'tested_module')
+            tests_path = os.path.join(tempdir, 'tests')
+            os.makedirs(module_path)
+            os.makedirs(tests_path)
+            files = {
+                os.path.join(module_path, '__init__.py'): "VALUE = 1\n",
+                os.path.join(tests_path, 'test_a.py'): "import time, tested_module\ntime.sleep(1)\n"
+                                                       "print('a', tested_module.VALUE)\n",
+                os.path.join(tests_path, 'test_b.py'): "import time\ntime.sleep(1)\nprint('b')\n",
+                os.path.join(tests_path, 'test_c.py'): "import sys\nprint('c failed', file=sys.stderr)\nsys.exit(3)\n",
+                os.path.join(tests_path, 'test_d.py'): "import time\nprint('d', flush=True)\ntime.sleep(30)\n",
+            }
+            for file_path, code in files.items():
+                with open(file_path, 'w') as fou:
+                    fou.write(code)
+
+            merger = PythonModuleMerger(module_path, output_dir=os.path.join(tempdir, 'dist'), test_jobs=4,
+                                        test_timeout=3)
+            with unittest.mock.patch('sys.stdout.write') as stdout_write:
+                self.assertFalse(merger.merge_files())
+            self.assertEqual(['test_a.py', 'test_b.py', 'test_c.py', 'test_d.py'],
+                             [os.path.basename(result.file_path) for result in merger.test_results])
+            self.assertEqual([True, True, False, False], [result.ok for result in merger.test_results])
+            self.assertEqual([0, 0, 3, None], [result.returncode for result in merger.test_results])
+            self.assertTrue(merger.test_results[3].timed_out)
+            self.assertEqual(['a 1\n', 'b\n', 'c failed\n', 'd\n'], [result.output for result in merger.test_results])
+            self.assertIn(unittest.mock.call('a 1\n'), stdout_write.call_args_list)
+            self.assertLess(max(result.elapsed for result in merger.test_results), 10)
+
     def test_merge_header(self):
         with tempfile.TemporaryDirectory() as tempdir:
             merger = PythonModuleMerger("test_modules/module1", output_dir=tempdir)